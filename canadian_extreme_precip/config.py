@@ -0,0 +1,72 @@
+'''Configuration of data paths and storage.
+
+Settings are read from an ini file and can be overridden by environment
+variables, so data can be moved, e.g. to a local scratch disk, without
+changing code.  The config file is given by CANADIAN_EXTREME_PRECIP_CONFIG
+or defaults to ~/.config/canadian_extreme_precip.ini, e.g.
+
+    [paths]
+    data_root = /scratch/Canada_extreme_precip
+    raw_station_path = /scratch/Canada_extreme_precip/Raw_station_files.zip
+
+    [storage]
+    cache_root = /nvme/cep_cache
+    cache_format = feather
+
+Each setting can also be set with an environment variable named
+CEP_<SETTING>, e.g. CEP_DATA_ROOT or CEP_CACHE_FORMAT.  Environment
+variables take precedence over the config file.
+'''
+
+from pathlib import Path
+import configparser
+import os
+
+
+CONFIG_ENV = 'CANADIAN_EXTREME_PRECIP_CONFIG'
+DEFAULT_CONFIG_FILE = Path.home() / '.config' / 'canadian_extreme_precip.ini'
+ENV_PREFIX = 'CEP_'
+
+# Root of this repository, for data files kept with the code
+REPO_PATH = Path(__file__).resolve().parents[1]
+
+
+def config_filepath():
+    '''Returns path to config file'''
+    return Path(os.environ.get(CONFIG_ENV, DEFAULT_CONFIG_FILE)).expanduser()
+
+
+def load_config(fpath=None):
+    '''Reads config file.  A missing file gives an empty config
+
+    :fpath: path to config file (default config_filepath())
+
+    :returns: configparser.ConfigParser
+    '''
+    config = configparser.ConfigParser()
+    config.read(fpath or config_filepath())
+    return config
+
+
+_config = load_config()
+
+
+def get_setting(key, default=None, section='paths'):
+    '''Returns setting from environment or config file
+
+    :key: setting name, environment variable is CEP_<KEY>
+    :default: value if setting is not found
+    :section: config file section
+    '''
+    value = os.environ.get(ENV_PREFIX + key.upper())
+    if value is None:
+        value = _config.get(section, key, fallback=None)
+    return default if value is None else value
+
+
+def get_path(key, default=None, section='paths'):
+    '''Returns setting as a path with ~ expanded, or default'''
+    value = get_setting(key, section=section)
+    if value is None:
+        return default
+    return Path(value).expanduser()
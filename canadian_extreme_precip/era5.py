@@ -0,0 +1,297 @@
+'''Shared tools for making climatologies from ERA5 monthly reanalysis files.
+
+Files are opened lazily with dask in explicit chunks, so each task holds
+one year of monthly fields for a tile of the grid.  Monthly climatologies
+are reduced blockwise, as with flox, by reshaping time into year and
+month and taking the mean over years, so memory is bounded by the chunk
+size and all cores can be used.
+
+Files can be subset to a region as they are opened, so only the part of
+the grid that is needed is read from disk.
+
+Climatologies are written as compressed netCDF4 or Zarr, chunked so each
+month of a variable is one chunk and a single monthly map can be read
+without decompressing the rest of the file.
+'''
+
+from contextlib import nullcontext
+from functools import partial
+from pathlib import Path
+
+import numpy as np
+import xarray as xr
+import dask
+from dask.diagnostics import ProgressBar
+
+from canadian_extreme_precip.filepath import ERA5_PATH
+
+
+ERA5_SURFACE_PATH = ERA5_PATH / 'surface' / 'monthly'
+ERA5_PRESSURE_LEVEL_PATH = ERA5_PATH / 'pressure_levels' / 'monthly'
+# Daily means, used for fields on event days
+ERA5_SURFACE_DAILY_PATH = ERA5_PATH / 'surface' / 'daily'
+ERA5_PRESSURE_LEVEL_DAILY_PATH = ERA5_PATH / 'pressure_levels' / 'daily'
+
+# One chunk is a year of monthly fields for a tile of the 0.25 degree grid,
+# about 6 MB of float32
+ERA5_CHUNKS = {'time': 12, 'level': 1, 'latitude': 256, 'longitude': 512}
+
+SCHEDULERS = ['threads', 'processes', 'synchronous']
+
+OUTPUT_FORMATS = ['netcdf', 'zarr']
+# zlib compression level for netCDF output, 0 for no compression
+COMPLEVEL = 4
+# Dimensions that are chunked one step at a time in output files.  Plots
+# read one month, and one level or station composite, at a time
+OUTPUT_STEP_DIMS = ['month', 'time', 'level', 'station']
+
+# Southern limit of polar cap covering the +/-3500 km extent of
+# plotting.plot_panarctic_panel, whose corners are at about 46.4 N
+PANARCTIC_MIN_LATITUDE = 45.
+
+
+def era5_filelist(path, prefix, year_start, year_end):
+    '''Returns list of yearly ERA5 files, e.g.
+    path/era5.single_levels.monthly.1980.nc for prefix era5.single_levels.monthly'''
+    return [path / f"{prefix}.{y}.nc" for y in range(year_start, year_end+1)]
+
+
+def subset_region(ds, bbox=None, min_latitude=None):
+    '''Selects a region from a dataset.  Selection is by slicing so, on a
+    lazily loaded dataset, only the region is read.
+
+    :ds: xarray.Dataset with latitude and longitude
+    :bbox: (lon_min, lat_min, lon_max, lat_max).  Longitudes are -180 to
+           180 or 0 to 360, on either grid convention.  If lon_min >
+           lon_max the box crosses the dateline or the prime meridian of
+           the grid.  Boxes 360 degrees wide keep all longitudes
+    :min_latitude: southern limit of polar cap
+
+    :returns: xarray.Dataset
+    '''
+    lat_min, lat_max = -90., 90.
+    if min_latitude is not None:
+        lat_min = min_latitude
+    if bbox is not None:
+        lat_min, lat_max = max(lat_min, bbox[1]), bbox[3]
+    descending = ds.latitude.values[0] > ds.latitude.values[-1]
+    ds = ds.sel(latitude=slice(lat_max, lat_min) if descending else slice(lat_min, lat_max))
+
+    if bbox is not None and bbox[2] - bbox[0] < 360.:
+        lon = ds.longitude.values
+        # Box in the longitude convention of the grid
+        west = 0. if lon.max() > 180. else -180.
+        lon_min, lon_max = [(v - west) % 360. + west for v in (bbox[0], bbox[2])]
+        if lon_min <= lon_max:
+            ds = ds.sel(longitude=slice(lon_min, lon_max))
+        else:
+            # Keep longitudes in order across the wrap
+            keep = np.concatenate([np.flatnonzero(lon >= lon_min),
+                                   np.flatnonzero(lon <= lon_max)])
+            ds = ds.isel(longitude=keep)
+    return ds
+
+
+def region_suffix(bbox=None, min_latitude=None):
+    '''Returns file name suffix for a region, empty for the globe'''
+    if bbox is not None:
+        return '.bbox_' + '_'.join(f'{v:g}' for v in bbox)
+    if min_latitude is not None:
+        return f'.north_of_{min_latitude:g}'
+    return ''
+
+
+def climatology_filepath(path, prefix, year_start, year_end, bbox=None,
+                         min_latitude=None, fmt='netcdf'):
+    '''Returns path to climatology written by make_era5_*_climatology,
+    e.g. path/era5.single_levels.monthly.climatology.1980to2010.nc'''
+    suffix = region_suffix(bbox, min_latitude)
+    return output_filepath(path / f"{prefix}.climatology.{year_start}to{year_end}{suffix}.nc",
+                           fmt)
+
+
+def _open_file(fpath, chunks, preprocess):
+    '''Opens one file lazily, applies preprocess and then chunks, so that
+    selections in preprocess are made before any data is read'''
+    ds = xr.open_dataset(fpath)
+    if preprocess is not None:
+        ds = preprocess(ds)
+    return ds.chunk({k: v for k, v in chunks.items() if k in ds.dims})
+
+
+def open_era5(filelist, chunks=ERA5_CHUNKS, preprocess=None, bbox=None,
+              min_latitude=None):
+    '''Opens ERA5 files lazily as a single dataset
+
+    :filelist: list of files
+    :chunks: dask chunks, dimensions that are not in the files are ignored
+    :preprocess: function applied to each file dataset before combining
+    :bbox: only read (lon_min, lat_min, lon_max, lat_max), see subset_region
+    :min_latitude: only read north of min_latitude
+
+    :returns: xarray.Dataset
+    '''
+    if bbox is not None or min_latitude is not None:
+        region = partial(subset_region, bbox=bbox, min_latitude=min_latitude)
+        if preprocess is None:
+            preprocess = region
+        else:
+            user_preprocess = preprocess
+            preprocess = lambda ds: user_preprocess(region(ds))
+    return xr.combine_by_coords([_open_file(f, chunks, preprocess) for f in filelist],
+                                combine_attrs='override')
+
+
+def _is_whole_years(time):
+    '''True if time is monthly from January to December of each year'''
+    months = time.dt.month.values
+    return len(months) % 12 == 0 and np.array_equal(
+        months, np.tile(np.arange(1, 13), len(months) // 12))
+
+
+def monthly_climatology(ds):
+    '''Calculates mean for each month of the year.  For whole years of
+    monthly data time is reshaped to year and month and averaged over
+    years, so each chunk is reduced independently and partial means are
+    combined in a tree.  Otherwise falls back to groupby.
+
+    :ds: xarray.Dataset or DataArray with monthly time dimension
+
+    :returns: mean with a month dimension
+    '''
+    if not _is_whole_years(ds.time):
+        return ds.groupby(ds.time.dt.month).mean(keep_attrs=True)
+    chunks = ds.chunks if isinstance(ds, xr.Dataset) else dict(zip(ds.dims, ds.chunks or ()))
+    if chunks and any(c % 12 for c in chunks['time']):
+        ds = ds.chunk({'time': 12 * max(1, min(chunks['time']) // 12)})
+    clim = (ds.coarsen(time=12)
+            .construct(time=('year', 'month'), keep_attrs=True)
+            .mean('year', keep_attrs=True))
+    clim = clim.drop_vars([v for v in clim.coords if 'month' in clim[v].dims])
+    return clim.assign_coords(month=np.arange(1, 13))
+
+
+def compute(delayed, scheduler='threads', workers=None, progress=True):
+    '''Computes a dask object with a local scheduler
+
+    :delayed: dask collection or xarray object
+    :scheduler: one of SCHEDULERS.  processes avoids contention for the
+                GIL when decoding compressed files
+    :workers: number of threads or processes (default number of cores)
+    :progress: show a progress bar
+    '''
+    if scheduler not in SCHEDULERS:
+        raise ValueError(f'Unknown scheduler {scheduler}, expected one of {SCHEDULERS}')
+    with dask.config.set(scheduler=scheduler, num_workers=workers), \
+         (ProgressBar() if progress else nullcontext()):
+        return delayed.compute()
+
+
+def output_chunks(da):
+    '''Returns output chunk shape for a variable, one map for each step of
+    OUTPUT_STEP_DIMS'''
+    return tuple(1 if dim in OUTPUT_STEP_DIMS else size
+                 for dim, size in zip(da.dims, da.shape))
+
+
+def output_filepath(outfile, fmt='netcdf'):
+    '''Returns path of output file for a format'''
+    return Path(outfile).with_suffix('.zarr') if fmt == 'zarr' else Path(outfile)
+
+
+def write_product(ds, outfile, fmt='netcdf', complevel=COMPLEVEL):
+    '''Writes a dataset as compressed netCDF4 or Zarr with one chunk for
+    each map
+
+    :ds: xarray.Dataset
+    :outfile: output path, the suffix is replaced by .zarr for Zarr
+    :fmt: one of OUTPUT_FORMATS
+    :complevel: zlib compression level for netCDF
+
+    :returns: path to file written
+    '''
+    if fmt not in OUTPUT_FORMATS:
+        raise ValueError(f'Unknown format {fmt}, expected one of {OUTPUT_FORMATS}')
+    outfile = output_filepath(outfile, fmt)
+    ds = ds.copy()
+    for variable in ds.variables.values():
+        variable.encoding = {}  # encoding from input files does not apply
+    if fmt == 'zarr':
+        chunks = {}
+        for da in ds.data_vars.values():
+            chunks.update(zip(da.dims, output_chunks(da)))
+        # Zarr arrays are compressed with Blosc by default
+        ds.chunk(chunks).to_zarr(outfile, mode='w', consolidated=True)
+    else:
+        encoding = {name: {'zlib': complevel > 0, 'complevel': complevel,
+                           'shuffle': True, 'chunksizes': output_chunks(da)}
+                    for name, da in ds.data_vars.items() if da.ndim > 0}
+        ds.to_netcdf(outfile, encoding=encoding)
+    return outfile
+
+
+def write_climatology(clim, outfile, scheduler='threads', workers=None,
+                      progress=True, fmt='netcdf', complevel=COMPLEVEL):
+    '''Computes and writes climatology with write_product.  The climatology
+    is computed before writing because netCDF files cannot be written from
+    several processes, it is only twelve fields for each variable.
+
+    :returns: path to file written'''
+    clim = compute(clim, scheduler=scheduler, workers=workers, progress=progress)
+    return write_product(clim, outfile, fmt=fmt, complevel=complevel)
+
+
+def open_climatology(fpath, month=None):
+    '''Opens climatology written by write_product lazily.  If fpath does
+    not exist but a Zarr store with the same name does, the store is
+    opened.
+
+    :fpath: path to climatology file
+    :month: select one month, only that month is read
+
+    :returns: xarray.Dataset
+    '''
+    fpath = Path(fpath)
+    zarr_path = fpath.with_suffix('.zarr')
+    if fpath.suffix == '.zarr' or (not fpath.exists() and zarr_path.exists()):
+        ds = xr.open_zarr(zarr_path)
+    else:
+        ds = xr.open_dataset(fpath)
+    if month is not None:
+        ds = ds.sel(month=month)
+    return ds
+
+
+def add_scheduler_arguments(parser):
+    '''Adds scheduler arguments to an argparse parser'''
+    parser.add_argument('--scheduler', choices=SCHEDULERS, default='threads',
+                        help='dask scheduler (default threads)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Number of threads or processes (default number of cores)')
+    parser.add_argument('--no_progress', action='store_true',
+                        help='Do not show progress bar')
+    return parser
+
+
+def add_output_arguments(parser):
+    '''Adds output format arguments to an argparse parser'''
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, default='netcdf',
+                        dest='fmt', help='Output format (default netcdf)')
+    parser.add_argument('--complevel', type=int, default=COMPLEVEL,
+                        help=f'netCDF compression level, 0 for none (default {COMPLEVEL})')
+    return parser
+
+
+def add_region_arguments(parser):
+    '''Adds region arguments to an argparse parser'''
+    region = parser.add_mutually_exclusive_group()
+    region.add_argument('--bbox', type=float, nargs=4, default=None,
+                        metavar=('LON_MIN', 'LAT_MIN', 'LON_MAX', 'LAT_MAX'),
+                        help='Only process bounding box')
+    region.add_argument('--min_latitude', type=float, default=None,
+                        help='Only process north of min_latitude')
+    region.add_argument('--panarctic', action='store_const', dest='min_latitude',
+                        const=PANARCTIC_MIN_LATITUDE,
+                        help=f'Only process north of {PANARCTIC_MIN_LATITUDE:g} N, '
+                        'the domain of pan-Arctic plots')
+    return parser
@@ -0,0 +1,153 @@
+'''Running monthly accumulators for ERA5 climatologies.
+
+For each variable the sum, count of valid values and sum of squares for
+each month of the year are kept in a netCDF store, with the years that
+have been added.  Years are added or removed one yearly file at a time,
+so a climatology for a new baseline or an extended record is derived
+from the store without reading every yearly file again.
+'''
+
+from pathlib import Path
+import os
+
+import numpy as np
+import xarray as xr
+
+from canadian_extreme_precip.era5 import compute
+
+
+STATISTICS = ['sum', 'count', 'sumsq']
+
+
+def year_accumulators(ds):
+    '''Returns sum, count and sum of squares for each month of one year
+
+    :ds: xarray.Dataset for one year with a time dimension.  Variables
+         without a time dimension are ignored
+
+    :returns: xarray.Dataset with variables <name>_sum, <name>_count and
+              <name>_sumsq with a month dimension
+    '''
+    years = np.unique(ds.time.dt.year)
+    if len(years) != 1:
+        raise ValueError(f'Expected one year, found {years}')
+    acc = {}
+    for name, da in ds.data_vars.items():
+        if 'time' not in da.dims:
+            continue
+        da = da.astype('float64')
+        grouped = da.groupby(da.time.dt.month)
+        acc[f'{name}_sum'] = grouped.sum()
+        acc[f'{name}_count'] = da.notnull().groupby(da.time.dt.month).sum()
+        acc[f'{name}_sumsq'] = (da ** 2).groupby(da.time.dt.month).sum()
+        acc[f'{name}_sum'].attrs = da.attrs
+    acc = xr.Dataset(acc).reindex(month=np.arange(1, 13), fill_value=0)
+    acc.attrs['years'] = [int(years[0])]
+    return acc
+
+
+def store_years(acc):
+    '''Returns list of years in accumulator store'''
+    if acc is None:
+        return []
+    return [int(y) for y in np.atleast_1d(acc.attrs.get('years', []))]
+
+
+def update_accumulators(acc, year_acc, remove=False):
+    '''Adds or removes one year of accumulators
+
+    :acc: accumulator store or None for an empty store
+    :year_acc: accumulators for one year from year_accumulators
+    :remove: subtract year from store
+
+    :returns: updated accumulator store, or None if no years remain
+    '''
+    year = store_years(year_acc)[0]
+    years = store_years(acc)
+    if remove:
+        if year not in years:
+            raise ValueError(f'{year} is not in accumulator store')
+        years.remove(year)
+        if not years:
+            return None
+        updated = acc - year_acc
+    else:
+        if year in years:
+            raise ValueError(f'{year} is already in accumulator store')
+        years.append(year)
+        updated = year_acc if acc is None else acc + year_acc
+    for name in updated.data_vars:
+        updated[name].attrs = (acc if acc is not None else year_acc)[name].attrs
+    updated.attrs['years'] = sorted(years)
+    return updated
+
+
+def load_accumulators(fpath):
+    '''Loads accumulator store, or None if it does not exist'''
+    if not Path(fpath).exists():
+        return None
+    return xr.load_dataset(fpath)
+
+
+def save_accumulators(acc, fpath):
+    '''Writes accumulator store.  The file is written under a temporary
+    name and renamed so an interrupted update leaves the old store.  An
+    empty store removes the file.'''
+    fpath = Path(fpath)
+    if acc is None:
+        fpath.unlink(missing_ok=True)
+        return
+    tmpfile = fpath.with_name(fpath.name + '.tmp')
+    acc.to_netcdf(tmpfile)
+    os.replace(tmpfile, fpath)
+    return
+
+
+def set_years(fpath, years, open_year, scheduler='threads', workers=None,
+              progress=True, verbose=False):
+    '''Updates accumulator store to hold exactly years, reading only the
+    files for years that are added or removed
+
+    :fpath: path to accumulator store
+    :years: list of years
+    :open_year: function returning dataset for a year
+    :scheduler: dask scheduler, see era5.compute
+
+    :returns: accumulator store
+    '''
+    acc = load_accumulators(fpath)
+    current = set(store_years(acc))
+    for year, remove in ([(y, True) for y in sorted(current - set(years))] +
+                         [(y, False) for y in sorted(set(years) - current)]):
+        if verbose: print(f'{"Removing" if remove else "Adding"} {year}')
+        year_acc = compute(year_accumulators(open_year(year)), scheduler=scheduler,
+                           workers=workers, progress=progress)
+        acc = update_accumulators(acc, year_acc, remove=remove)
+        # Save after each year so an interrupted update can be resumed
+        save_accumulators(acc, fpath)
+    return acc
+
+
+def climatology_from_accumulators(acc, std=False):
+    '''Calculates monthly mean, and optionally standard deviation, from
+    accumulators
+
+    :acc: accumulator store
+    :std: add <name>_std variables
+
+    :returns: xarray.Dataset with month dimension
+    '''
+    names = [name[:-len('_sum')] for name in acc.data_vars if name.endswith('_sum')]
+    clim = {}
+    for name in names:
+        count = acc[f'{name}_count']
+        mean = (acc[f'{name}_sum'] / count).where(count > 0)
+        clim[name] = mean.astype('float32')
+        clim[name].attrs = acc[f'{name}_sum'].attrs
+        if std:
+            variance = (acc[f'{name}_sumsq'] / count - mean ** 2).clip(min=0)
+            clim[f'{name}_std'] = np.sqrt(variance).astype('float32')
+            clim[f'{name}_std'].attrs = acc[f'{name}_sum'].attrs
+    clim = xr.Dataset(clim)
+    clim.attrs['years'] = acc.attrs['years']
+    return clim
@@ -0,0 +1,117 @@
+'''Composites of daily ERA5 anomalies on station event dates.
+
+Events are reduced to a matrix of counts of events for each station and
+time step, so each time step is read once however many stations have an
+event on it.  Time steps are read in batches and anomalies from the
+monthly climatology added to the sums for every station with one matrix
+product, so memory is bounded by the batch and the composites, not by
+the number of events.
+'''
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from canadian_extreme_precip.era5 import compute
+
+
+# Number of time steps read at once
+BATCH_SIZE = 32
+
+
+def event_time_positions(times, dates):
+    '''Returns positions of the daily time steps on event dates
+
+    :times: pandas.DatetimeIndex of daily time steps
+    :dates: event dates
+
+    :returns: numpy array of positions, -1 for dates not in times
+
+    :raises ValueError: if times are not daily.  A composite of monthly
+                        means is not the state on event days
+    '''
+    days = pd.DatetimeIndex(times).normalize()
+    if not days.is_unique or (len(days) > 1 and
+                              np.diff(days.values).min() > np.timedelta64(1, 'D')):
+        raise ValueError('Composites need one time step for each day, '
+                         'use daily mean ERA5 fields')
+    return days.get_indexer(pd.DatetimeIndex(dates).normalize())
+
+
+def event_weights(stations, positions):
+    '''Counts events for each station and time step
+
+    :stations: station of each event
+    :positions: time step of each event from event_time_positions
+
+    :returns: station names, time steps with events and array of event
+              counts with shape (station, step)
+    '''
+    found = positions >= 0
+    station_codes, station_names = pd.factorize(np.asarray(stations)[found])
+    steps, step_codes = np.unique(positions[found], return_inverse=True)
+    weights = np.zeros((len(station_names), len(steps)))
+    np.add.at(weights, (station_codes, step_codes), 1)
+    return station_names, steps, weights
+
+
+def composite_anomalies(ds, climatology, events, variables=None,
+                        batch_size=BATCH_SIZE, scheduler='threads',
+                        workers=None, verbose=False):
+    '''Calculates mean anomalies from monthly climatology on event dates for
+    each station
+
+    :ds: xarray.Dataset of daily fields opened lazily, e.g. with
+         era5.open_era5
+    :climatology: climatology on the same grid from era5.open_climatology
+    :events: dataframe or index with station and date levels, e.g. from
+             get_p95_events.exceedance_events.  Events outside ds are
+             ignored
+    :variables: variables to composite (default variables in ds and
+                climatology)
+    :batch_size: number of time steps read at once
+    :scheduler: dask scheduler, see era5.compute
+    :workers: number of threads or processes
+
+    :returns: xarray.Dataset of float32 mean anomalies with a station
+              dimension, and count of events for each station
+    '''
+    index = events if isinstance(events, pd.MultiIndex) else events.index
+    if variables is None:
+        variables = [v for v in ds.data_vars
+                     if v in climatology.data_vars and 'time' in ds[v].dims]
+    climatology = climatology[variables].load()
+
+    positions = event_time_positions(ds.indexes['time'],
+                                     index.get_level_values('date'))
+    stations, steps, weights = event_weights(index.get_level_values('station'),
+                                             positions)
+
+    sums, templates = {}, {}
+    for first in range(0, len(steps), batch_size):
+        batch = slice(first, first + batch_size)
+        block = compute(ds[variables].isel(time=steps[batch]),
+                        scheduler=scheduler, workers=workers, progress=False)
+        anomaly = block - climatology.sel(month=block.time.dt.month).drop_vars('month')
+        for v in variables:
+            da = anomaly[v].transpose('time', ...)
+            total = np.tensordot(weights[:, batch], da.values, axes=(1, 0))
+            if v in sums:
+                sums[v] += total
+            else:
+                sums[v] = total
+                templates[v] = da.isel(time=0, drop=True)
+                templates[v].attrs = ds[v].attrs
+        if verbose:
+            print(f'Read {min(first + batch_size, len(steps))} of {len(steps)} time steps')
+
+    count = weights.sum(axis=1)
+    composites = xr.Dataset(coords={'station': stations.astype(str)})
+    for v, template in templates.items():
+        mean = (sums[v] / count.reshape((-1,) + (1,) * template.ndim)).astype('float32')
+        composites[v] = xr.DataArray(mean, dims=('station', *template.dims),
+                                     coords=template.coords,
+                                     attrs=template.attrs)
+    composites['count'] = ('station', count.astype(int))
+    composites['count'].attrs = {'long_name': 'number of events'}
+    return composites
@@ -0,0 +1,159 @@
+'''Samples ERA5 fields at station locations.
+
+Grid indices and weights for all stations are calculated once, cached,
+and used to extract every station with one vectorised indexing operation
+on the (lazy) dataset, in place of a .sel for each station.
+'''
+
+import hashlib
+import os
+
+import numpy as np
+import xarray as xr
+
+from canadian_extreme_precip.reader import (read_station_locations,
+                                            CACHE_ROOT, CACHE_DIRNAME)
+from canadian_extreme_precip.filepath import STATION_FILEPATH, ERA5_PATH
+
+
+METHODS = ['nearest', 'bilinear']
+
+
+def load_station_coordinates(fpath=STATION_FILEPATH):
+    '''Returns station names, latitudes and longitudes from station
+    locations file'''
+    df = read_station_locations(fpath)
+    return df.index.values, df.lat.values.astype(float), df.lon.values.astype(float)
+
+
+def _axis_positions(coord, values, periodic=False):
+    '''Returns fractional positions of values on a regular 1d grid
+    coordinate, and a mask that is False outside the grid'''
+    coord = np.asarray(coord, dtype=float)
+    step = coord[1] - coord[0]
+    if not np.allclose(np.diff(coord), step):
+        raise ValueError('Grid coordinates must be regularly spaced')
+    position = (values - coord[0]) / step
+    if periodic:
+        return np.mod(position, len(coord)), np.ones(len(values), dtype=bool)
+    inside = (position >= -0.5) & (position <= len(coord) - 0.5)
+    return np.clip(position, 0, len(coord) - 1), inside
+
+
+def grid_indices(grid_lat, grid_lon, lat, lon, method='nearest'):
+    '''Calculates grid indices and weights for points.  Each point is the
+    weighted sum of one (nearest) or four (bilinear) grid cells.
+
+    :grid_lat: grid latitudes, regularly spaced, ascending or descending
+    :grid_lon: grid longitudes, regularly spaced.  Grids spanning 360
+               degrees wrap
+    :lat: point latitudes
+    :lon: point longitudes, -180 to 180 or 0 to 360
+    :method: one of METHODS
+
+    :returns: dict of lat_index, lon_index and weight arrays with shape
+              (point, corner) and valid, False for points outside grid
+    '''
+    if method not in METHODS:
+        raise ValueError(f'Unknown method {method}, expected one of {METHODS}')
+    grid_lon = np.asarray(grid_lon, dtype=float)
+    if grid_lon.max() > 180.:
+        lon = np.mod(lon, 360.)
+    else:
+        lon = np.mod(lon + 180., 360.) - 180.
+    nlon = len(grid_lon)
+    periodic = np.isclose(nlon * abs(grid_lon[1] - grid_lon[0]), 360.)
+
+    y, y_valid = _axis_positions(grid_lat, lat)
+    x, x_valid = _axis_positions(grid_lon, lon, periodic=periodic)
+    valid = y_valid & x_valid
+
+    if method == 'nearest':
+        lat_index = np.rint(y).astype(int)[:, np.newaxis]
+        lon_index = np.rint(x).astype(int)[:, np.newaxis]
+        lon_index = np.mod(lon_index, nlon) if periodic else lon_index
+        weight = np.ones(lat_index.shape)
+    else:
+        y0 = np.minimum(np.floor(y).astype(int), len(grid_lat) - 2)
+        x0 = np.floor(x).astype(int)
+        if not periodic:
+            x0 = np.minimum(x0, nlon - 2)
+        fy, fx = y - y0, x - x0
+        x1 = np.mod(x0 + 1, nlon) if periodic else x0 + 1
+        lat_index = np.stack([y0, y0, y0 + 1, y0 + 1], axis=1)
+        lon_index = np.stack([x0, x1, x0, x1], axis=1)
+        weight = np.stack([(1 - fy) * (1 - fx), (1 - fy) * fx,
+                           fy * (1 - fx), fy * fx], axis=1)
+    return {'lat_index': lat_index, 'lon_index': lon_index,
+            'weight': weight, 'valid': valid}
+
+
+def _index_key(grid_lat, grid_lon, lat, lon, method):
+    '''Returns hash of grid, points and method for cache file name'''
+    sha = hashlib.sha256(method.encode())
+    for values in (grid_lat, grid_lon, lat, lon):
+        sha.update(np.ascontiguousarray(values, dtype=float).tobytes())
+    return sha.hexdigest()[:16]
+
+
+def index_cache_filepath(key, method):
+    '''Returns path to cached station indices'''
+    cache_dir = CACHE_ROOT if CACHE_ROOT is not None else ERA5_PATH / CACHE_DIRNAME
+    return cache_dir / f'era5_station_index.{method}.{key}.npz'
+
+
+def station_indices(ds, lat, lon, method='nearest', use_cache=True):
+    '''Returns grid indices for points from grid_indices, reading them from
+    a cache when grid, points and method are unchanged.  Failure to write
+    the cache is not an error.'''
+    grid_lat, grid_lon = ds.latitude.values, ds.longitude.values
+    cache = index_cache_filepath(_index_key(grid_lat, grid_lon, lat, lon, method), method)
+    if use_cache and cache.exists():
+        with np.load(cache) as f:
+            return dict(f)
+    index = grid_indices(grid_lat, grid_lon, lat, lon, method=method)
+    if use_cache:
+        tmpfile = cache.with_name(f'{cache.stem}.{os.getpid()}.tmp.npz')
+        try:
+            cache.parent.mkdir(parents=True, exist_ok=True)
+            np.savez(tmpfile, **index)
+            os.replace(tmpfile, cache)
+        except OSError:
+            if tmpfile.exists():
+                tmpfile.unlink()
+    return index
+
+
+def extract_stations(ds, index, stations):
+    '''Extracts points from a dataset with one vectorised indexing
+    operation.  Works lazily on dask backed datasets.
+
+    :ds: xarray.Dataset or DataArray with latitude and longitude
+    :index: grid indices from station_indices
+    :stations: station names
+
+    :returns: dataset with a station dimension in place of latitude and
+              longitude.  Stations outside the grid are NaN.
+    '''
+    dims = ('station', 'corner')
+    corners = ds.isel(latitude=xr.DataArray(index['lat_index'], dims=dims),
+                      longitude=xr.DataArray(index['lon_index'], dims=dims))
+    weight = xr.DataArray(index['weight'], dims=dims)
+    points = (corners * weight).sum('corner', skipna=False, keep_attrs=True)
+    points = points.drop_vars(['latitude', 'longitude'], errors='ignore')
+    points = points.where(xr.DataArray(index['valid'], dims='station'))
+    return points.assign_coords(station=np.asarray(stations, dtype=str))
+
+
+def sample_stations(ds, method='nearest', station_file=STATION_FILEPATH,
+                    use_cache=True):
+    '''Samples dataset at all stations in station locations file
+
+    :returns: dataset with station dimension and station lat and lon
+              coordinates
+    '''
+    stations, lat, lon = load_station_coordinates(station_file)
+    index = station_indices(ds, lat, lon, method=method, use_cache=use_cache)
+    points = extract_stations(ds, index, stations)
+    return points.assign_coords(station_lat=('station', lat),
+                                station_lon=('station', lon))
@@ -0,0 +1,193 @@
+'''Catalogue of extreme precipitation events.  Consecutive days with
+precipitation greater than a station's baseline percentile are grouped
+into one event, for all stations at once, and the catalogue is written
+as a parquet file so it can be queried by station, season and magnitude
+without reading daily data.'''
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from canadian_extreme_precip.panel import load_panel
+from canadian_extreme_precip.reader import VALUE_DECIMALS
+from canadian_extreme_precip.get_p95_events import (exceedance_events,
+                                                    SEASONS,
+                                                    year_start,
+                                                    year_end)
+from canadian_extreme_precip.filepath import EVENT_CATALOGUE_PATH
+
+
+PRECIPITATION = 'TOTAL_PRECIPITATION'
+FLAG = PRECIPITATION + '_FLAG'
+
+# Rows in each parquet row group.  The catalogue is sorted by station and
+# start date, so row groups that cannot match a selection are skipped
+ROW_GROUP_SIZE = 2000
+
+CATALOGUE_COLUMNS = ['station', 'start', 'end', 'duration', 'total',
+                     'peak', 'peak_date', 'threshold', 'quality_flags', 'season']
+
+
+def _flags_involved(flags, event_id, nevent):
+    '''Returns string of distinct non-empty flags in each event'''
+    flags = pd.Categorical(flags)
+    present = np.zeros((nevent, len(flags.categories)), dtype=bool)
+    coded = flags.codes >= 0
+    present[event_id[coded], flags.codes[coded]] = True
+    involved = np.full(nevent, '', dtype=object)
+    for name, in_event in zip(flags.categories, present.T):
+        name = str(name).strip()
+        if name:
+            involved = np.where(in_event, involved + name, involved)
+    return involved
+
+
+def find_events(precipitation, flags=None, thresholds=None):
+    '''Groups consecutive exceedance days into events
+
+    :precipitation: daily exceedances indexed by station and date, sorted,
+                    e.g. precipitation column of exceedance_events
+    :flags: precipitation flags on the same index (optional)
+    :thresholds: threshold for each exceedance (optional)
+
+    :returns: pandas dataframe with one row for each event and
+              CATALOGUE_COLUMNS
+    '''
+    stations = precipitation.index.get_level_values('station')
+    dates = pd.DatetimeIndex(precipitation.index.get_level_values('date'))
+    values = precipitation.values.astype(float).round(VALUE_DECIMALS)
+
+    # A new event starts when the station changes or a day is skipped
+    station_codes, station_names = pd.factorize(stations)
+    new_event = np.ones(len(values), dtype=bool)
+    new_event[1:] = ((station_codes[1:] != station_codes[:-1]) |
+                     (np.diff(dates.values) != np.timedelta64(1, 'D')))
+    event_id = np.cumsum(new_event) - 1
+    starts = np.flatnonzero(new_event)
+    nevent = len(starts)
+    ends = np.append(starts[1:], len(values))[:nevent] - 1
+
+    if nevent:
+        totals = np.add.reduceat(values, starts).round(VALUE_DECIMALS)
+        peaks = np.maximum.reduceat(values, starts)
+    else:
+        totals = peaks = np.array([])
+    # Position of first day with the peak value in each event
+    at_peak = values == peaks[event_id]
+    peak_position = np.full(nevent, len(values))
+    np.minimum.at(peak_position, event_id[at_peak], np.flatnonzero(at_peak))
+
+    catalogue = pd.DataFrame({
+        'station': station_names[station_codes[starts]],
+        'start': dates[starts],
+        'end': dates[ends],
+        'duration': ends - starts + 1,
+        'total': totals,
+        'peak': peaks,
+        'peak_date': dates[peak_position],
+        'threshold': (thresholds.values[starts] if thresholds is not None
+                      else np.nan),
+        'quality_flags': (_flags_involved(flags.values, event_id, nevent)
+                          if flags is not None else ''),
+        })
+    month_to_season = np.empty(13, dtype=object)
+    for season, months in SEASONS.items():
+        month_to_season[months] = season
+    catalogue['season'] = month_to_season[catalogue.start.dt.month.values]
+    return catalogue[CATALOGUE_COLUMNS]
+
+
+def build_event_catalogue(stations=None, percentile=0.95, threshold=0.,
+                          baseline_start=year_start, baseline_end=year_end,
+                          start=None, end=None):
+    '''Builds catalogue of events with precipitation greater than
+    baseline percentile
+
+    :stations: list of stations (default all stations)
+    :percentile: percentile as a fraction
+    :threshold: only use precipitation greater than threshold to calculate
+                percentile
+    :baseline_start: first date of baseline for percentile
+    :baseline_end: last date of baseline for percentile
+    :start: first date to find events (default start of records)
+    :end: last date to find events (default end of records)
+
+    :returns: pandas dataframe of events, see find_events
+    '''
+    panel = load_panel(stations, columns=[PRECIPITATION, FLAG])
+    exceeds = exceedance_events(panel[PRECIPITATION], percentile=percentile,
+                                threshold=threshold,
+                                baseline_start=baseline_start,
+                                baseline_end=baseline_end,
+                                start=start, end=end)
+    catalogue = find_events(exceeds['precipitation'],
+                            flags=panel[FLAG].reindex(exceeds.index),
+                            thresholds=exceeds['threshold'])
+    catalogue.attrs = {'percentile': percentile,
+                       'baseline': f'{baseline_start} to {baseline_end}'}
+    return catalogue
+
+
+def write_event_catalogue(catalogue, fpath=EVENT_CATALOGUE_PATH):
+    '''Writes catalogue as parquet sorted by station and start date, in
+    row groups of ROW_GROUP_SIZE events so that row group statistics can
+    be used to skip events that do not match a selection'''
+    catalogue = catalogue.sort_values(['station', 'start'], kind='stable')
+    tmpfile = fpath.with_name(fpath.name + '.tmp')
+    catalogue.to_parquet(tmpfile, index=False, row_group_size=ROW_GROUP_SIZE)
+    tmpfile.replace(fpath)
+    return fpath
+
+
+def read_event_catalogue(fpath=EVENT_CATALOGUE_PATH, stations=None,
+                         seasons=None, min_total=None, min_peak=None,
+                         min_duration=None, start=None, end=None):
+    '''Reads events from catalogue.  Selections are pushed down to the
+    parquet reader, so row groups without matching events are skipped.
+
+    :stations: list of stations
+    :seasons: list of seasons, keys of SEASONS
+    :min_total: smallest event total precipitation
+    :min_peak: smallest event peak daily precipitation
+    :min_duration: shortest event in days
+    :start: only events starting on or after start
+    :end: only events starting on or before end
+
+    :returns: pandas dataframe of events
+    '''
+    filters = []
+    if stations is not None:
+        filters.append(('station', 'in', list(stations)))
+    if seasons is not None:
+        filters.append(('season', 'in', list(seasons)))
+    if min_total is not None:
+        filters.append(('total', '>=', min_total))
+    if min_peak is not None:
+        filters.append(('peak', '>=', min_peak))
+    if min_duration is not None:
+        filters.append(('duration', '>=', min_duration))
+    if start is not None:
+        filters.append(('start', '>=', pd.Timestamp(start)))
+    if end is not None:
+        filters.append(('start', '<=', pd.Timestamp(end)))
+    return pd.read_parquet(fpath, filters=filters or None).reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Builds catalogue of extreme precipitation events')
+    parser.add_argument('--percentile', type=float, default=0.95,
+                        help='Percentile as a fraction (default 0.95)')
+    parser.add_argument('--baseline_start', default=year_start)
+    parser.add_argument('--baseline_end', default=year_end)
+    parser.add_argument('--outfile', type=Path, default=EVENT_CATALOGUE_PATH)
+
+    args = parser.parse_args()
+
+    catalogue = build_event_catalogue(percentile=args.percentile,
+                                      baseline_start=args.baseline_start,
+                                      baseline_end=args.baseline_end)
+    write_event_catalogue(catalogue, args.outfile)
+    print(catalogue.groupby('station').duration.describe())
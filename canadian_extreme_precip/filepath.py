@@ -1,24 +1,37 @@
-'''Contains filepaths for data etc'''
+'''Contains filepaths for data etc
 
-from pathlib import Path
+Paths can be changed with a config file or environment variables, see
+config.py.  Defaults are the original data directories and the data
+directory in this repository.'''
 
-HOME = Path.home()
+from pathlib import Path
 
-DATAPATH = HOME / 'Data' / 'Rain_on_snow' / 'Canada_extreme_precip'
+from canadian_extreme_precip.config import get_path, REPO_PATH
+from canadian_extreme_precip.storage import list_files
 
-RAW_STATION_PATH = DATAPATH / 'Raw_station_files'
-COMBINED_PATH = DATAPATH / 'Combined_files'
-FIGURE_PATH = DATAPATH / 'Figures'
-CYCLONE_PATH = Path('/home/apbarret/src/Canadian_extreme_precip/'
-                    'data/CycloneFrequency_CanadianWeatherStations_1950_2020.csv')
-CLIMATOLOGY_PATH = DATAPATH / "Climatology"
+HOME = Path.home()
 
-STATION_FILEPATH = Path('/home/apbarret/src/Canadian_extreme_precip/'
-                        'data/station_locations.csv')
-STATS_FILEPATH = Path('/home/apbarret/src/Canadian_extreme_precip/'
-                      'data/station_precip_statistics.csv')
-P95_FILEPATH = Path('/home/apbarret/src/Canadian_extreme_precip/'
-                    'data', 'canadian_extreme_precip.table03.p95_event_counts.csv')
+DATAPATH = get_path('data_root', HOME / 'Data' / 'Rain_on_snow' / 'Canada_extreme_precip')
+
+RAW_STATION_PATH = get_path('raw_station_path', DATAPATH / 'Raw_station_files')
+COMBINED_PATH = get_path('combined_path', DATAPATH / 'Combined_files')
+FIGURE_PATH = get_path('figure_path', DATAPATH / 'Figures')
+# Combined station files from Mark, used to make the original merge recipes
+MARK_PATH = get_path('mark_path', DATAPATH / 'From_Mark')
+CLIMATOLOGY_PATH = get_path('climatology_path', DATAPATH / "Climatology")
+ERA5_PATH = get_path('era5_path', Path('/', 'projects', 'AROSS', 'Reanalysis', 'ERA5'))
+INVENTORY_PATH = get_path('inventory_path', COMBINED_PATH / 'station_inventory.sqlite')
+EVENT_CATALOGUE_PATH = get_path('event_catalogue', DATAPATH / 'p95_event_catalogue.parquet')
+
+# Files kept with the code
+REPO_DATA_PATH = get_path('repo_data_path', REPO_PATH / 'data')
+CYCLONE_PATH = REPO_DATA_PATH / 'CycloneFrequency_CanadianWeatherStations_1950_2020.csv'
+STATION_FILEPATH = REPO_DATA_PATH / 'station_locations.csv'
+STATS_FILEPATH = REPO_DATA_PATH / 'station_precip_statistics.csv'
+P95_FILEPATH = REPO_DATA_PATH / 'canadian_extreme_precip.table03.p95_event_counts.csv'
+BAD_RECORD_LIST_PATH = get_path('bad_records', REPO_DATA_PATH / 'bad_records.csv')
+MERGE_RECIPE_JSON = get_path('merge_recipe_json',
+                             REPO_PATH / 'dataset_preparation' / 'station_merge_recipe.json')
 
 
 def raw_station_filepath(climate_identifier):
@@ -39,7 +52,7 @@ def combined_station_filepath(station_name):
 def combined_station_filelist():
     """Return list of station files"""
     station_files = {}
-    for f in COMBINED_PATH.glob('*combined.csv'):
+    for f in list_files(COMBINED_PATH, '*combined.csv'):
         station_name = ' '.join(f.stem.split('.')[0].split('_'))
         station_files[station_name] = f
     return station_files
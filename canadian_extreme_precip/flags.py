@@ -9,7 +9,7 @@ ECCC_FLAGS = {
     'F': 'Accumulated and estimated',
     'L': 'Precipitation may or may not have occurred',
     'M': 'Missing',
-    'N': 'Temperature missing but known to be > 0'
+    'N': 'Temperature missing but known to be > 0',
     'S': 'More than one occurrence',
     'T': 'Trace',
     'Y': 'Temperature missing but known to be < 0',
@@ -1,46 +1,168 @@
 """Counts number of events above 95th percentile, e.g. to 5%"""
 
+import numpy as np
 import pandas as pd
 
-from canadian_extreme_precip.get_precipitation_quantiles import (load_precip_data,
-                                                                 get_quantiles)
+from canadian_extreme_precip.get_precipitation_quantiles import (load_precip_panel,
+                                                                 sort_wet_days,
+                                                                 sorted_quantiles)
+from canadian_extreme_precip.reader import date_bounds
 from canadian_extreme_precip.filepath import P95_FILEPATH
 
 
-stations_list = [
-    'inuvik',
-    'sachs harbour',
-    'cambridge bay',
-    'resolute bay',
-    'alert',
-    'eureka',
-    'hall beach',
-    'clyde river',
-    'cape dyer',
-    'pond inlet',
-    ]
-
 year_start = '1960'
 year_end = '1995'
 
-def get_p95_events(station, threshold=0.):
-    """Gets P95 event counts for a station"""
-    df = load_precip_data(station)
-    df = df[year_start: year_end]
-    p95 = get_quantiles(df, threshold=threshold, quantiles=[0.95]).values[0]
-    df95 = df[df > p95]
-    return df95.groupby(df95.index.month).count()
+SEASONS = {
+    'DJF': [12, 1, 2],
+    'MAM': [3, 4, 5],
+    'JJA': [6, 7, 8],
+    'SON': [9, 10, 11],
+    }
+
+
+def exceedance_thresholds(df, percentiles=(0.95,), threshold=0.,
+                          start=None, end=None):
+    """Calculates percentiles of wet day precipitation in a baseline period
+    for each station
+
+    :df: precipitation panel indexed by station and date
+    :percentiles: sequence of percentiles as fractions
+    :threshold: only use precipitation greater than threshold
+    :start: first date of baseline (default start of record)
+    :end: last date of baseline (default end of record)
+
+    :returns: pandas dataframe with stations as rows and percentiles as
+              columns
+    """
+    return sorted_quantiles(sort_wet_days(df, threshold=threshold),
+                            threshold=threshold, start=start, end=end,
+                            quantiles=percentiles)
+
+
+def _select_period(df, start=None, end=None):
+    """Selects rows of a panel indexed by station and date between start
+    and end"""
+    first, last = date_bounds(start, end)
+    dates = df.index.get_level_values('date')
+    in_period = np.ones(len(df), dtype=bool)
+    if first is not None:
+        in_period &= dates >= first
+    if last is not None:
+        in_period &= dates <= last
+    return df[in_period]
+
+
+def count_exceedances(df, percentiles=(0.95,), threshold=0.,
+                      baseline_start=year_start, baseline_end=year_end,
+                      start=year_start, end=year_end, seasons=None,
+                      percent=False):
+    """Counts days with precipitation greater than baseline percentiles for
+    all stations, percentiles and months or seasons at once
+
+    :df: precipitation panel indexed by station and date
+    :percentiles: sequence of percentiles as fractions
+    :threshold: only use precipitation greater than threshold to calculate
+                percentiles
+    :baseline_start: first date of baseline for percentiles
+    :baseline_end: last date of baseline for percentiles
+    :start: first date to count exceedances
+    :end: last date to count exceedances
+    :seasons: dict of lists of months to count by season, e.g. SEASONS.
+              Default is to count by month
+    :percent: return percentage of each station's exceedances in each
+              month or season instead of counts (default False)
+
+    :returns: pandas dataframe with (percentile, station) rows and months
+              or seasons as columns
+    """
+    thresholds = exceedance_thresholds(df, percentiles=percentiles,
+                                       threshold=threshold,
+                                       start=baseline_start, end=baseline_end)
+
+    df = _select_period(df, start=start, end=end)
+    dates = df.index.get_level_values('date')
+
+    # Broadcast thresholds for every percentile to every row
+    stations = df.index.get_level_values('station')
+    station_thresholds = thresholds.reindex(stations).values
+    exceeds = pd.DataFrame(df.values[:, np.newaxis] > station_thresholds,
+                           index=df.index, columns=thresholds.columns)
+
+    if seasons is None:
+        periods = list(range(1, 13))
+        period = pd.Index(dates.month, name='month')
+    else:
+        periods = list(seasons)
+        month_to_season = np.empty(13, dtype=object)
+        for season, months in seasons.items():
+            month_to_season[months] = season
+        period = pd.Index(month_to_season[dates.month], name='season')
+
+    counts = exceeds.groupby([stations, period], sort=False).sum()
+    counts = (counts.rename_axis(columns='percentile')
+              .stack().unstack(period.name, fill_value=0)
+              .reorder_levels(['percentile', 'station'])
+              .reindex(columns=periods, fill_value=0))
+    counts = counts.reindex(pd.MultiIndex.from_product(
+        [thresholds.columns, thresholds.index], names=['percentile', 'station']),
+        fill_value=0)
+    if percent:
+        return counts.divide(counts.sum(axis=1), axis='rows') * 100.
+    return counts
+
+
+def exceedance_events(df, percentile=0.95, threshold=0.,
+                      baseline_start=year_start, baseline_end=year_end,
+                      start=year_start, end=year_end):
+    """Finds days with precipitation greater than a baseline percentile for
+    all stations
+
+    :df: precipitation panel indexed by station and date
+    :percentile: percentile as a fraction
+    :threshold: only use precipitation greater than threshold to calculate
+                percentile
+    :baseline_start: first date of baseline for percentile
+    :baseline_end: last date of baseline for percentile
+    :start: first date to find events
+    :end: last date to find events
+
+    :returns: pandas dataframe indexed by station and date with
+              precipitation and threshold for each exceedance
+    """
+    thresholds = exceedance_thresholds(df, percentiles=[percentile],
+                                       threshold=threshold,
+                                       start=baseline_start, end=baseline_end)
+    df = _select_period(df, start=start, end=end)
+    station_thresholds = (thresholds[percentile]
+                          .reindex(df.index.get_level_values('station')).values)
+    exceeds = df.values > station_thresholds
+    return pd.DataFrame({'precipitation': df.values[exceeds],
+                         'threshold': station_thresholds[exceeds]},
+                        index=df.index[exceeds])
+
+
+def get_p95_events(stations=None, threshold=0.):
+    """Gets P95 event counts for each month for stations
+
+    :stations: station name or list of station names (default all)
+
+    :returns: pandas dataframe of counts with months as rows and stations
+              as columns, or pandas series of counts by month for a single
+              station name"""
+    if isinstance(stations, str):
+        return get_p95_events([stations], threshold=threshold)[stations]
+    df = load_precip_panel(stations, start=year_start, end=year_end)
+    counts = count_exceedances(df, percentiles=[0.95], threshold=threshold)
+    return counts.loc[0.95].T
 
 
 def main():
-    result = {}
-    for station in stations_list:
-        result[station] = get_p95_events(station, threshold=0.)
-    df = pd.DataFrame(result)
-    df = df.where(df.notna(), 0.)
-    df = df * 100. / df.sum()
-    df.T.to_csv(P95_FILEPATH)
-    print(df.round().T.astype(int))
+    df = load_precip_panel(start=year_start, end=year_end)
+    df = count_exceedances(df, percentiles=[0.95], threshold=0.,
+                           percent=True).loc[0.95]
+    df.rename_axis(index=None).to_csv(P95_FILEPATH)
+    print(df.round().astype(int))
 
 
 if __name__ == "__main__":
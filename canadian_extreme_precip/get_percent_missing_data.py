@@ -1,25 +1,19 @@
-from canadian_extreme_precip.get_precipitation_quantiles import load_precip_data
+import pandas as pd
 
-
-stations_list = [
-    'inuvik',
-    'sachs harbour',
-    'cambridge bay',
-    'resolute bay',
-    'alert',
-    'eureka',
-    'hall beach',
-    'clyde river',
-    'cape dyer',
-    ]
+from canadian_extreme_precip.get_precipitation_quantiles import load_precip_panel
+from canadian_extreme_precip.panel import station_list
 
 
 def main():
-    for station in stations_list:
-        df = load_precip_data(station)
-        nrecord = len(df)
-        nmissing = df.isna().sum()
-        print(f"{station.title():13s} {df.index.year[0]:4d} {df.index.year[-1]:4d} {nmissing * 100. / nrecord:3.0f}")
+    df = load_precip_panel(station_list(exclude=['pond inlet']))
+    years = pd.Series(df.index.get_level_values('date').year, index=df.index)
+    summary = pd.DataFrame({
+        'first_year': years.groupby(level='station', sort=False).first(),
+        'last_year': years.groupby(level='station', sort=False).last(),
+        'percent_missing': df.isna().groupby(level='station', sort=False).mean() * 100.,
+        })
+    for station, first_year, last_year, percent_missing in summary.itertuples():
+        print(f"{station.title():13s} {first_year:4d} {last_year:4d} {percent_missing:3.0f}")
 
 
 if __name__ == "__main__":
@@ -3,60 +3,184 @@
 import numpy as np
 import pandas as pd
 
-from canadian_extreme_precip.reader import read_combined_file
+from canadian_extreme_precip.reader import read_combined_file, date_bounds
 from canadian_extreme_precip.filepath import (combined_station_filepath,
                                               FIGURE_PATH,
                                               STATS_FILEPATH)
+from canadian_extreme_precip.panel import load_panel
 
 
 MIN_PRECIPITATION = 0.001  # Threshold precipitation for PDF
 
-stations_list = [
-    'cape dyer',
-    'resolute bay',
-    'eureka',
-    'alert',
-    'clyde river',
-    'cambridge bay',
-    'hall beach',
-    'sachs harbour',
-    'inuvik',
-    'pond inlet',
-    ]
-
 QUANTILES = [0.01, 0.05, 0.1, 0.25, 0.5, 0.75, 0.90, 0.95, 0.99, 1.]
 
+# ECCC precipitation is reported to 0.1 mm, so a histogram with this bin
+# width holds every value exactly
+PRECIPITATION_RESOLUTION = 0.1
+
 
-def load_precip_data(station):
-    df = read_combined_file(combined_station_filepath(station))
+def load_precip_data(station, start=None, end=None):
+    """Loads total precipitation for a station between start and end"""
+    df = read_combined_file(combined_station_filepath(station),
+                            columns=['TOTAL_PRECIPITATION'],
+                            start=start, end=end)
     return df['TOTAL_PRECIPITATION']
 
 
+def load_precip_panel(stations=None, start=None, end=None):
+    """Loads total precipitation for stations, indexed by station and date"""
+    return load_panel(stations, columns=['TOTAL_PRECIPITATION'],
+                      start=start, end=end)['TOTAL_PRECIPITATION']
+
+
 def get_quantiles(df, threshold=0., quantiles=QUANTILES):
-    """Calculates quantiles"""
+    """Calculates quantiles.  For a panel indexed by station and date
+    returns a dataframe of quantiles for each station"""
     df_t = df[df > threshold]
+    if isinstance(df.index, pd.MultiIndex):
+        stations = df.index.get_level_values(0).unique()
+        return (df_t.groupby(level=0)
+                .quantile(quantiles, interpolation='lower')
+                .unstack().reindex(stations))
     return df_t.quantile(quantiles, interpolation='lower')
 
 
+def sort_wet_days(df, threshold=0.):
+    """Sorts precipitation above threshold once so that quantiles for any
+    higher threshold or any period can be taken from the sorted values
+    with sorted_quantiles
+
+    :df: precipitation series indexed by date or by station and date
+    :threshold: lowest threshold that will be queried
+
+    :returns: series sorted by value, or by station and then value
+    """
+    wet = df[df > threshold]
+    if isinstance(df.index, pd.MultiIndex):
+        codes, _ = pd.factorize(wet.index.get_level_values(0))
+        return wet.iloc[np.lexsort((wet.values, codes))]
+    return wet.sort_values(kind='stable')
+
+
+def sorted_quantiles(sorted_df, threshold=0., start=None, end=None,
+                     quantiles=QUANTILES):
+    """Calculates quantiles from precipitation sorted by sort_wet_days.
+    Gives the same result as get_quantiles but selecting values keeps them
+    in order so no further sorting is needed.
+
+    :sorted_df: output from sort_wet_days
+    :threshold: only use precipitation greater than threshold
+    :start: first date of period (default start of record)
+    :end: last date of period, partial dates include the whole period
+          (default end of record)
+    :quantiles: list of quantiles
+
+    :returns: series of quantiles or, for a panel, dataframe of quantiles
+              for each station
+    """
+    selected = sorted_df[sorted_df > threshold]
+    first, last = date_bounds(start, end)
+    dates = selected.index.get_level_values(-1)
+    if first is not None:
+        selected = selected[dates >= first]
+        dates = selected.index.get_level_values(-1)
+    if last is not None:
+        selected = selected[dates <= last]
+
+    quantiles = np.asarray(quantiles)
+    if isinstance(sorted_df.index, pd.MultiIndex):
+        stations = sorted_df.index.get_level_values(0).unique()
+        grouper = selected.groupby(level=0, sort=False)
+        rank = grouper.cumcount().values
+        nvalue = grouper.transform('size').values
+        result = {}
+        for q in quantiles:
+            # Same as interpolation='lower'
+            at_quantile = selected[rank == np.floor(q * (nvalue - 1))]
+            result[q] = at_quantile.droplevel(-1)
+        return pd.DataFrame(result).reindex(stations)
+    if len(selected) == 0:
+        # As get_quantiles when there are no values
+        return pd.Series(np.nan, index=quantiles)
+    position = np.floor(quantiles * (len(selected) - 1)).astype(int)
+    return pd.Series(selected.values[position], index=quantiles)
+
+
+def precip_histogram(df, resolution=PRECIPITATION_RESOLUTION):
+    """Counts precipitation values in bins of width resolution.  Because
+    precipitation is reported at a fixed resolution the histogram is an
+    exact summary of the values whose size depends only on the maximum
+    value.  Histograms of chunks, periods or stations can be added with
+    add_histograms.
+
+    :df: precipitation series
+    :resolution: bin width, the reporting resolution of precipitation
+
+    :returns: series of counts indexed by precipitation
+    """
+    values = df.values[np.isfinite(df.values)]
+    counts = np.bincount(np.rint(values / resolution).astype(int))
+    bins = np.round(np.arange(len(counts)) * resolution, 6)
+    return pd.Series(counts, index=bins)[counts > 0]
+
+
+def add_histograms(histograms):
+    """Adds histograms from precip_histogram"""
+    total = pd.Series(dtype='int64')
+    for histogram in histograms:
+        total = total.add(histogram, fill_value=0)
+    return total.astype('int64')
+
+
+def histogram_quantiles(histogram, threshold=0., quantiles=QUANTILES):
+    """Calculates quantiles from a histogram.  Equal to get_quantiles for
+    values reported at the histogram resolution.
+
+    :histogram: output from precip_histogram or add_histograms
+    :threshold: only use precipitation greater than threshold
+    :quantiles: list of quantiles
+
+    :returns: series of quantiles
+    """
+    histogram = histogram[histogram.index > threshold]
+    cumulative = histogram.cumsum().values
+    rank = np.floor(np.asarray(quantiles) * (cumulative[-1] - 1))
+    position = np.searchsorted(cumulative, rank, side='right')
+    return pd.Series(histogram.index.values[position], index=quantiles)
+
+
+def streaming_histogram(stations, start=None, end=None):
+    """Builds one histogram for many stations reading a station at a time,
+    so memory does not grow with the number of stations
+
+    :stations: list of station names
+    :start: first date to read (default start of record)
+    :end: last date to read (default end of record)
+
+    :returns: series of counts indexed by precipitation
+    """
+    return add_histograms(precip_histogram(load_precip_data(station, start, end))
+                          for station in stations)
+
+
 def get_precipitation_quantiles():
 
-    stats = {}
-    
+    df = sort_wet_days(load_precip_panel(), threshold=0.01)
+
+    stats_df = sorted_quantiles(df, threshold=0.01)
+    q_1mm = sorted_quantiles(df, threshold=1.)
+    q_baseline = sorted_quantiles(df, threshold=1., start='1960', end='1995')
+
     print(f"{' '*15}, {', '.join([f'{v*100.:>3.0f}%' for v in QUANTILES])}")
-    for station in stations_list:
-        df = load_precip_data(station)
-        q = get_quantiles(df, threshold=0.01)
-        stats[station] = q
+    for station, q in stats_df.iterrows():
         print(f"{station:15s}, {', '.join([f'{v:>4.1f}' for v in q])}")
-
-        q = get_quantiles(df, threshold=1.)
+        q = q_1mm.loc[station]
         print(f"{'threshold=1.':>15s}, {', '.join([f'{v:>4.1f}' for v in q])}")
-        q = get_quantiles(df['1960':'1995'], threshold=1.)
+        q = q_baseline.loc[station]
         print(f"{'1965-1960':>15s}, {', '.join([f'{v:>4.1f}' for v in q])}")
 
-    stats_df = pd.DataFrame(stats).T
     stats_df.columns = [f"p{int(c*100):02d}" for c in stats_df.columns]
-    stats_df.to_csv(STATS_FILEPATH)
+    stats_df.rename_axis(index=None).to_csv(STATS_FILEPATH)
 
 if __name__ == "__main__":
     get_precipitation_quantiles()
@@ -0,0 +1,273 @@
+'''Persistent inventory of combined station files.  Station names,
+identifiers, coordinates, date coverage, completeness of each variable
+and file hashes are kept in an SQLite database next to the combined
+files, so stations can be selected by region, period or completeness
+without opening data files.  The inventory is updated by
+make_combined_files for each location it writes.'''
+
+from pathlib import Path
+import datetime as dt
+import hashlib
+import json
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from canadian_extreme_precip.reader import read_combined_file, column_dtype
+from canadian_extreme_precip.filepath import (INVENTORY_PATH,
+                                              COMBINED_PATH,
+                                              combined_station_filelist)
+
+
+# Variables that completeness is recorded for
+INVENTORY_VARIABLES = [flag[:-len('_FLAG')] for flag in column_dtype]
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS stations (
+    location TEXT PRIMARY KEY,
+    filename TEXT,
+    climate_identifiers TEXT,
+    station_names TEXT,
+    x REAL,
+    y REAL,
+    first_date TEXT,
+    last_date TEXT,
+    ndays INTEGER,
+    size INTEGER,
+    mtime_ns INTEGER,
+    sha256 TEXT,
+    updated TEXT
+);
+CREATE TABLE IF NOT EXISTS completeness (
+    location TEXT REFERENCES stations(location) ON DELETE CASCADE,
+    variable TEXT,
+    nvalid INTEGER,
+    fraction REAL,
+    PRIMARY KEY (location, variable)
+);
+CREATE INDEX IF NOT EXISTS stations_xy ON stations (x, y);
+'''
+
+
+def connect(inventory_path=INVENTORY_PATH):
+    '''Opens inventory database, creating tables if needed'''
+    conn = sqlite3.connect(inventory_path)
+    conn.execute('PRAGMA foreign_keys = ON')
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _sha256(fpath, blocksize=1 << 20):
+    '''Returns sha256 of file contents'''
+    sha = hashlib.sha256()
+    with open(fpath, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def _unique(series):
+    '''Returns unique non-missing values of a column in record order'''
+    return series.dropna().unique().tolist()
+
+
+def _identifier(value):
+    '''Returns climate identifier as a string.  Identifiers can contain
+    letters, numeric identifiers read with missing rows are floats'''
+    if isinstance(value, (float, np.floating)) and float(value).is_integer():
+        value = int(value)
+    return str(value)
+
+
+def station_record(location, fpath, df=None):
+    '''Describes a combined file for the inventory
+
+    :location: location name
+    :fpath: path to combined file
+    :df: combined dataframe, read from fpath if not given
+
+    :returns: dict with stations row and completeness of each variable.
+              Dates are None for an empty file.
+    '''
+    fpath = Path(fpath)
+    if df is None:
+        df = read_combined_file(fpath)
+    stat = fpath.stat()
+    if len(df):
+        ndays = (df.index[-1] - df.index[0]).days + 1
+        first_date = df.index[0].strftime('%Y-%m-%d')
+        last_date = df.index[-1].strftime('%Y-%m-%d')
+    else:
+        first_date = last_date = None
+        ndays = 0
+    # Coordinates of the latest station
+    coords = df[['x', 'y']].dropna()
+    x, y = coords.iloc[-1] if len(coords) else (np.nan, np.nan)
+    completeness = {}
+    for variable in INVENTORY_VARIABLES:
+        if variable in df and ndays:
+            nvalid = int(df[variable].notna().sum())
+            completeness[variable] = (nvalid, nvalid / ndays)
+    return {
+        'location': location,
+        'filename': fpath.name,
+        'climate_identifiers': json.dumps([_identifier(c) for c in _unique(df['CLIMATE_IDENTIFIER'])]),
+        'station_names': json.dumps(_unique(df['STATION_NAME'])),
+        'x': float(x),
+        'y': float(y),
+        'first_date': first_date,
+        'last_date': last_date,
+        'ndays': ndays,
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'sha256': _sha256(fpath),
+        'updated': dt.datetime.now().isoformat(timespec='seconds'),
+        'completeness': completeness,
+        }
+
+
+def update_inventory(records, inventory_path=INVENTORY_PATH):
+    '''Adds or replaces records from station_record in the inventory'''
+    columns = ['location', 'filename', 'climate_identifiers', 'station_names',
+               'x', 'y', 'first_date', 'last_date', 'ndays', 'size',
+               'mtime_ns', 'sha256', 'updated']
+    with connect(inventory_path) as conn:
+        for record in records:
+            conn.execute(f'INSERT OR REPLACE INTO stations ({", ".join(columns)}) '
+                         f'VALUES ({", ".join("?" * len(columns))})',
+                         [record[c] for c in columns])
+            conn.execute('DELETE FROM completeness WHERE location = ?',
+                         (record['location'],))
+            conn.executemany('INSERT INTO completeness VALUES (?, ?, ?, ?)',
+                             [(record['location'], variable, nvalid, fraction)
+                              for variable, (nvalid, fraction)
+                              in record['completeness'].items()])
+    conn.close()
+    return
+
+
+def remove_locations(locations, inventory_path=INVENTORY_PATH):
+    '''Removes locations from the inventory'''
+    with connect(inventory_path) as conn:
+        conn.executemany('DELETE FROM stations WHERE location = ?',
+                         [(location,) for location in locations])
+    conn.close()
+    return
+
+
+def inventory_locations(inventory_path=INVENTORY_PATH):
+    '''Returns set of locations in the inventory'''
+    if not Path(inventory_path).exists():
+        return set()
+    with connect(inventory_path) as conn:
+        locations = {row[0] for row in conn.execute('SELECT location FROM stations')}
+    conn.close()
+    return locations
+
+
+def load_inventory(inventory_path=INVENTORY_PATH):
+    '''Returns inventory as dataframe indexed by location, with a
+    completeness column for each variable'''
+    with connect(inventory_path) as conn:
+        stations = pd.read_sql('SELECT * FROM stations', conn,
+                               index_col='location',
+                               parse_dates=['first_date', 'last_date'])
+        completeness = pd.read_sql('SELECT location, variable, fraction FROM completeness',
+                                   conn)
+    conn.close()
+    completeness = completeness.pivot(index='location', columns='variable',
+                                      values='fraction')
+    return stations.join(completeness)
+
+
+def select_stations(bbox=None, start=None, end=None, min_completeness=None,
+                    variable='TOTAL_PRECIPITATION', inventory_path=INVENTORY_PATH):
+    '''Selects stations from the inventory
+
+    :bbox: (lon_min, lat_min, lon_max, lat_max) of stations to select
+    :start: select stations with records starting on or before start
+    :end: select stations with records ending on or after end
+    :min_completeness: select stations with at least this fraction of
+                       days with valid values of variable
+    :variable: variable for min_completeness (default TOTAL_PRECIPITATION)
+
+    :returns: list of location names
+    '''
+    query = 'SELECT s.location FROM stations s'
+    conditions = []
+    params = []
+    if min_completeness is not None:
+        query += ' JOIN completeness c ON s.location = c.location AND c.variable = ?'
+        params.append(variable)
+        conditions.append('c.fraction >= ?')
+        params.append(min_completeness)
+    if bbox is not None:
+        conditions.append('s.x BETWEEN ? AND ? AND s.y BETWEEN ? AND ?')
+        params.extend([bbox[0], bbox[2], bbox[1], bbox[3]])
+    if start is not None:
+        conditions.append('s.first_date <= ?')
+        params.append(pd.Timestamp(start).strftime('%Y-%m-%d'))
+    if end is not None:
+        conditions.append('s.last_date >= ?')
+        params.append(pd.Period(end).end_time.strftime('%Y-%m-%d')
+                      if isinstance(end, str) else pd.Timestamp(end).strftime('%Y-%m-%d'))
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    with connect(inventory_path) as conn:
+        locations = [row[0] for row in conn.execute(query + ' ORDER BY s.location', params)]
+    conn.close()
+    return locations
+
+
+def station_filelist(inventory_path=INVENTORY_PATH, **criteria):
+    '''Returns dictionary of combined file paths keyed by location.  Uses
+    the inventory if it exists, otherwise searches COMBINED_PATH.
+
+    :criteria: keywords for select_stations
+    '''
+    if not Path(inventory_path).exists():
+        if criteria:
+            raise FileNotFoundError(f'{inventory_path} not found, run '
+                                    'python -m canadian_extreme_precip.inventory')
+        return combined_station_filelist()
+    locations = select_stations(inventory_path=inventory_path, **criteria)
+    with connect(inventory_path) as conn:
+        filenames = dict(conn.execute('SELECT location, filename FROM stations'))
+    conn.close()
+    return {location: COMBINED_PATH / filenames[location] for location in locations}
+
+
+def build_inventory(inventory_path=INVENTORY_PATH, verbose=False):
+    '''Adds combined files that are missing from the inventory or have
+    changed since they were added, and removes locations whose files no
+    longer exist'''
+    current = {}
+    if Path(inventory_path).exists():
+        with connect(inventory_path) as conn:
+            current = {location: (size, mtime_ns) for location, size, mtime_ns
+                       in conn.execute('SELECT location, size, mtime_ns FROM stations')}
+        conn.close()
+    filelist = combined_station_filelist()
+    records = []
+    for location, fpath in sorted(filelist.items()):
+        stat = fpath.stat()
+        if current.get(location) == (stat.st_size, stat.st_mtime_ns):
+            continue
+        if verbose: print(f'Adding {location}')
+        records.append(station_record(location, fpath))
+    update_inventory(records, inventory_path=inventory_path)
+    remove_locations(set(current) - set(filelist), inventory_path=inventory_path)
+    return
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Updates inventory of combined station files')
+    parser.add_argument('--verbose', '-v', action='store_true')
+
+    args = parser.parse_args()
+
+    build_inventory(verbose=args.verbose)
+    print(load_inventory())
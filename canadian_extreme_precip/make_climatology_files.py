@@ -2,32 +2,28 @@
 observations and cyclone statistics"""
 
 
-from reader import read_combined_file, read_cyclone_climatology
-from filepath import combined_station_filepath, climatology_filepath
-from utils import to_monthly, to_climatology
-
-
-stations_list = [
-    'cape dyer',
-    'resolute bay',
-    'eureka',
-    'alert',
-    'clyde river',
-    'cambridge bay',
-    'hall beach',
-    'sachs harbour',
-    'inuvik',
-    'pond inlet',
-    ]
-
-
-def load_climatology(station):
-    """Loads station data and calculates climatology
-    and loads cyclone frequency"""
-    df = read_combined_file(combined_station_filepath(station))
-    df_mon = to_monthly(df)
-    df_clm = to_climatology(df_mon.loc['1960':'1995', :])
-    return df_clm
+from canadian_extreme_precip.reader import read_cyclone_climatology
+from canadian_extreme_precip.filepath import climatology_filepath, CYCLONE_PATH
+from canadian_extreme_precip.panel import load_panel, station_list
+from canadian_extreme_precip.utils import (to_monthly, to_climatology,
+                                           MONTHLY_MEAN_VARIABLES,
+                                           MONTHLY_SUM_VARIABLES,
+                                           MONTHLY_FRACTION_VARIABLES)
+
+
+year_start = '1960'
+year_end = '1995'
+
+
+def load_climatology(stations):
+    """Loads station data and calculates climatology for all stations
+
+    :returns: pandas dataframe indexed by station and month"""
+    columns = (MONTHLY_MEAN_VARIABLES + MONTHLY_SUM_VARIABLES +
+               MONTHLY_FRACTION_VARIABLES)
+    panel = load_panel(stations, columns=columns,
+                       start=year_start, end=year_end)
+    return to_climatology(to_monthly(panel))
 
 
 def make_climatology_files(verbose=False):
@@ -35,14 +31,16 @@ def make_climatology_files(verbose=False):
     df_cyclone = read_cyclone_climatology(CYCLONE_PATH)
     df_cyclone.columns = [f"CYCLONE_{col.upper()}" for col in df_cyclone.columns]
 
-    for station in stations_list:
-        if verbose: print(f"Making climatology for {station.title()}")
-        df = load_climatology(station)
-        df = df.join(df_cyclone.loc[station.title(), :])
+    stations = station_list()
+    if verbose: print(f"Making climatology for {', '.join(s.title() for s in stations)}")
+    df_clm = load_climatology(stations)
+
+    for station in stations:
+        df = df_clm.loc[station].join(df_cyclone.loc[station.title(), :])
 
         outpath = climatology_filepath(station)
         if verbose: print(f"   Writing climatology to {outpath}\n")
-        df.to_csv(outpath)
+        df.rename_axis(index=None).to_csv(outpath)
 
 
 if __name__ == "__main__":
@@ -2,20 +2,35 @@
 dataset_preparation/station_merge_recipe.json'''
 
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 import json
 import datetime as dt
+import hashlib
+import os
 import re
+import time
 import warnings
 
 import numpy as np
 import matplotlib.pyplot as plt
 import pandas as pd
 
-from canadian_extreme_precip.reader import read_station_file
-from canadian_extreme_precip.filepath import raw_station_filepath, COMBINED_PATH
-
-MERGE_RECIPE_JSON = Path('/', 'home', 'apbarret', 'src', 'Canadian_extreme_precip', 'dataset_preparation', 'station_merge_recipe.json')
-BAD_RECORD_LIST_PATH = Path('/', 'home', 'apbarret', 'src', 'Canadian_extreme_precip', 'data', 'bad_records.csv')
+from canadian_extreme_precip.reader import (read_station_file,
+                                            iter_station_file,
+                                            CSV_CHUNKSIZE)
+from canadian_extreme_precip.filepath import (raw_station_filepath,
+                                              COMBINED_PATH,
+                                              MERGE_RECIPE_JSON,
+                                              BAD_RECORD_LIST_PATH)
+from canadian_extreme_precip.storage import file_exists, file_stat, read_bytes
+from canadian_extreme_precip.inventory import (station_record,
+                                               update_inventory,
+                                               inventory_locations)
+
+# Records inputs used to build each combined file so unchanged locations
+# are not rebuilt
+MANIFEST_PATH = COMBINED_PATH / 'combined_manifest.json'
 
 XBEGIN = dt.datetime(1920,1,1)
 XEND = dt.datetime(2021,12,31)
@@ -176,26 +191,199 @@ def get_recipe():
     return recipes
 
 
-def combine_files(recipe, reindex_dataframe=True):
-    '''Combines station files'''
+# Ways of combining station records.  concat appends the station windows,
+# other strategies align stations on a daily index and choose a value for
+# each day:
+#    priority: record from the first station in the recipe with a record
+#    fill: as priority but variables missing from that station are filled
+#          from the next station with a value
+#    best_flag: for each variable, the value with the best flag in
+#               FLAG_RANK, ties going to the first station in the recipe
+# fill and best_flag can take values from a different station than the
+# station columns, so the climate identifier of the station each value
+# came from is kept in a <VARIABLE>_SOURCE column
+MERGE_STRATEGIES = ['concat', 'priority', 'fill', 'best_flag']
+
+# Rank of ECCC flags for best_flag merges, lower is better.  Unflagged
+# values rank 0, unknown flags rank as estimates
+FLAG_RANK = {
+    'T': 1,
+    '†': 2,
+    '^': 3,
+    'E': 4,
+    'C': 4,
+    'S': 4,
+    'A': 5,
+    'B': 5,
+    'F': 5,
+    'L': 6,
+    'N': 7,
+    'Y': 7,
+    'M': 8,
+    }
+UNKNOWN_FLAG_RANK = 4
+SOURCE_SUFFIX = '_SOURCE'
+
+
+def _flag_ranks(flags):
+    '''Returns FLAG_RANK for each flag in a column, missing flags rank 0.
+    Flags are ranked through their category codes, so only the distinct
+    flags are looked up'''
+    flags = pd.Categorical(flags)
+    lookup = np.array([FLAG_RANK.get(flag, UNKNOWN_FLAG_RANK) if str(flag).strip() else 0
+                       for flag in flags.categories] + [0], dtype=int)
+    return lookup[flags.codes]
+
+
+def read_recipe_stations(recipe):
+    '''Reads station files for a recipe clipped to their windows
+
+    :returns: list of dataframes in recipe order'''
     df_list = []
     for station in recipe['stations']:
         filepath = raw_station_filepath(station['climate_identifier'])
-        df_list.append(read_station_file(filepath)[station['start_date']:station['end_date']])
-    df = pd.concat(df_list)
-    df = df.sort_index()
+        df_list.append(read_station_file(filepath,
+                                         start=station['start_date'],
+                                         end=station['end_date']))
+    return df_list
+
+
+def _flagged_variables(df):
+    '''Returns variables that have a flag column'''
+    return [c[:-len('_FLAG')] for c in df.columns
+            if c.endswith('_FLAG') and c[:-len('_FLAG')] in df.columns]
+
+
+def _station_records(df_list):
+    '''Returns daily index spanning all stations and boolean array
+    (station x day) that is True where a station has a record'''
+    first = min(df.index.min() for df in df_list if len(df))
+    last = max(df.index.max() for df in df_list if len(df))
+    index = pd.date_range(first, last, freq='D')
+    has_record = np.array([index.isin(df.index) for df in df_list])
+    return index, has_record
+
+
+def merge_report(recipe, df_list):
+    '''Reports overlaps and gaps between station records
+
+    :returns: dict of number of days in span of combined record, days with
+              records from more than one station, days with no record and
+              days taken from each station by priority'''
+    index, has_record = _station_records(df_list)
+    nrecord = has_record.sum(axis=0)
+    choice = np.where(nrecord > 0, has_record.argmax(axis=0), -1)
+    return {
+        'ndays': len(index),
+        'overlap_days': int((nrecord > 1).sum()),
+        'gap_days': int((nrecord == 0).sum()),
+        'station_days': {str(station['climate_identifier']): int((choice == i).sum())
+                         for i, station in enumerate(recipe['stations'])},
+        }
+
+
+def print_merge_report(report):
+    '''Prints merge report to stdout'''
+    print(f'   {report["ndays"]} days, {report["overlap_days"]} overlapping, '
+          f'{report["gap_days"]} with no record')
+    for station, ndays in report['station_days'].items():
+        print(f'   {station}: {ndays} days')
+    return
+
+
+def merge_frames(df_list, strategy='priority', reindex_dataframe=True):
+    '''Merges station records aligned on a daily index using one of
+    MERGE_STRATEGIES other than concat
+
+    :df_list: list of station dataframes in priority order
+    :strategy: merge strategy
+    :reindex_dataframe: keep days with no record as empty records
+
+    :returns: pandas dataframe
+    '''
+    index, has_record = _station_records(df_list)
+    aligned = [df.reindex(index) for df in df_list]
+    columns = aligned[0].columns
+    days = np.arange(len(index))
+
+    # Record level choice, first station with a record
+    row_choice = has_record.argmax(axis=0)
+
+    def stack(column):
+        return np.array([np.asarray(df[column].values, dtype=object)
+                         if df[column].dtype.name == 'category'
+                         else df[column].values for df in aligned])
+
+    choice = {column: row_choice for column in columns}
+    sources = {}
+    if strategy in ['fill', 'best_flag']:
+        # Each station file has one climate identifier
+        identifiers = np.array([str(df['CLIMATE_IDENTIFIER'].iloc[0]) if len(df) else None
+                                for df in df_list], dtype=object)
+        for variable in _flagged_variables(aligned[0]):
+            values = np.array([df[variable].values for df in aligned], dtype='float64')
+            has_value = np.isfinite(values)
+            if strategy == 'fill':
+                rank = np.where(has_value, 0, 1)
+            else:
+                rank = np.array([_flag_ranks(df[variable + '_FLAG']) for df in aligned])
+                rank = np.where(has_value, rank, max(FLAG_RANK.values()) + 1)
+            # argmin takes the first station for ties so stations without
+            # a value for any station fall back to the record choice
+            any_value = has_value.any(axis=0)
+            variable_choice = np.where(any_value, rank.argmin(axis=0), row_choice)
+            choice[variable] = choice[variable + '_FLAG'] = variable_choice
+            sources[variable + SOURCE_SUFFIX] = np.where(
+                any_value, identifiers[variable_choice], None)
+    elif strategy != 'priority':
+        raise ValueError(f'Unknown merge strategy {strategy}, expected one of {MERGE_STRATEGIES}')
+
+    merged = {column: stack(column)[choice[column], days] for column in columns}
+    df = pd.DataFrame(merged, index=index, columns=columns)
+    df = df.astype({column: 'category' if dtype.name == 'category' else dtype
+                    for column, dtype in aligned[0].dtypes.items()})
+    for column, source in sources.items():
+        df.insert(df.columns.get_loc(column[:-len(SOURCE_SUFFIX)] + '_FLAG') + 1,
+                  column, source)
+    if not reindex_dataframe:
+        df = df[has_record.any(axis=0)]
+    return df
+
+
+def combine_files(recipe, reindex_dataframe=True, strategy='concat',
+                  return_report=False):
+    '''Combines station files
+
+    :recipe: merge recipe for a location.  A merge_strategy key in the
+             recipe overrides strategy
+    :reindex_dataframe: fill missing days with empty records
+    :strategy: one of MERGE_STRATEGIES (default concat)
+    :return_report: also return overlap and gap report from merge_report
+
+    :returns: combined dataframe and, if return_report, report'''
+    df_list = read_recipe_stations(recipe)
+    strategy = recipe.get('merge_strategy', strategy)
+
+    if strategy == 'concat':
+        df = pd.concat(df_list)
+        df = df.sort_index()
     
-    # Check if number of records in df match days in timespan
-    ndays = (df.index[-1] - df.index[0]).days
-    nrecord = len(df.index)
-    if nrecord != ndays:
-        print(f'Record timespan in days does not match number of indices\n' + \
-              f'{nrecord} records found, {ndays} expected!')
-        if reindex_dataframe:
-            print('Reindexing dataframe to generate temporaly complete series')
-            expected_index = pd.date_range(df.index[0], df.index[-1], freq='D')
-            df = df.reindex(expected_index)
-            
+        # Check if number of records in df match days in timespan
+        ndays = (df.index[-1] - df.index[0]).days
+        nrecord = len(df.index)
+        if nrecord != ndays:
+            print(f'Record timespan in days does not match number of indices\n' + \
+                  f'{nrecord} records found, {ndays} expected!')
+            if reindex_dataframe:
+                print('Reindexing dataframe to generate temporaly complete series')
+                expected_index = pd.date_range(df.index[0], df.index[-1], freq='D')
+                df = df.reindex(expected_index)
+    else:
+        df = merge_frames(df_list, strategy=strategy,
+                          reindex_dataframe=reindex_dataframe)
+
+    if return_report:
+        return df, merge_report(recipe, df_list)
     return df
 
 
@@ -215,9 +403,9 @@ def print_variable_flags(df):
     return
 
 
-def make_png_filename(location):
+def make_png_filename(location, outdir=COMBINED_PATH):
     loc_name = '_'.join(re.split('-|\s', location))
-    return COMBINED_PATH / f'{loc_name}.variable.time_series.png'
+    return Path(outdir) / f'{loc_name}.variable.time_series.png'
     
 
 def make_csv_filename(location):
@@ -227,18 +415,298 @@ def make_csv_filename(location):
 
 def get_bad_records_list():
     return pd.read_csv(BAD_RECORD_LIST_PATH,
-                       header=0, parse_dates=True,
+                       header=0, parse_dates=['date'],
                        skipinitialspace=True)
 
 
-def fix_bad_records(df, bad_df, location):
-    for _, values in bad_df[bad_df.station == location].iterrows():
-        df.loc[values.date, values.variable] = np.nan
+def index_bad_records(bad_df):
+    '''Groups bad records by station and variable
+
+    :bad_df: dataframe of bad records from get_bad_records_list
+
+    :returns: dict keyed by station of dicts keyed by variable containing
+              sorted DatetimeIndex of bad dates
+    '''
+    bad_records = {}
+    for (station, variable), dates in bad_df.groupby(['station', 'variable']).date:
+        bad_records.setdefault(station, {})[variable] = pd.DatetimeIndex(dates).sort_values()
+    return bad_records
+
+
+def fix_bad_records(df, bad_records, location):
+    '''Sets values for bad records to NaN in place
+
+    :df: combined dataframe
+    :bad_records: bad records indexed by index_bad_records
+    :location: location name
+
+    :returns: dict keyed by variable giving number of values set to NaN
+              and number of bad record dates outside the record
+    '''
+    report = {}
+    for variable, dates in bad_records.get(location, {}).items():
+        mask = df.index.isin(dates)
+        df.loc[mask, variable] = np.nan
+        dates = dates.unique()
+        report[variable] = {'blanked': int(mask.sum()),
+                            'outside_record': int((~dates.isin(df.index)).sum())}
+    return report
+
+
+def print_bad_record_report(report):
+    '''Prints number of bad records set to NaN for each variable to stdout'''
+    for variable, counts in report.items():
+        print(f'   {variable}: {counts["blanked"]} values set to NaN, '
+              f'{counts["outside_record"]} dates outside record')
+    return
+
+
+def load_manifest():
+    '''Loads manifest of inputs used to build combined files.  Returns an
+    empty manifest if none exists'''
+    if not MANIFEST_PATH.exists():
+        return {}
+    with open(MANIFEST_PATH) as json_file:
+        return json.load(json_file)
+
+
+def save_manifest(manifest):
+    '''Writes manifest, replacing the old file only once the new one is
+    complete'''
+    tmpfile = MANIFEST_PATH.with_suffix('.json.tmp')
+    with open(tmpfile, 'w') as f:
+        f.write(json.dumps(manifest, indent=4, sort_keys=True))
+    os.replace(tmpfile, MANIFEST_PATH)
     return
 
+
+def _hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_signature(fpath, previous=None):
+    '''Returns size, modification time and sha256 of file contents
+
+    :fpath: path to file
+    :previous: signature from an earlier manifest.  If size and
+               modification time are unchanged the stored hash is reused
+               so unchanged files are not read
+
+    :returns: dict or None if file does not exist
+    '''
+    if not file_exists(fpath):
+        return None
+    stat = file_stat(fpath)
+    signature = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    if previous and all(previous.get(k) == v for k, v in signature.items()):
+        signature['sha256'] = previous['sha256']
+    else:
+        signature['sha256'] = _hash_bytes(read_bytes(fpath))
+    return signature
+
+
+def location_inputs(recipe, bad_records, previous=None, **kwargs):
+    '''Returns manifest entry describing all inputs to a combined file
+
+    :recipe: merge recipe for a location
+    :bad_records: bad records indexed by index_bad_records
+    :previous: manifest entry from last build of location
+    :kwargs: keywords passed to combine_location that change the output
+
+    :returns: dict
+    '''
+    previous_inputs = (previous or {}).get('inputs', {})
+    inputs = {}
+    for station in recipe['stations']:
+        fpath = raw_station_filepath(station['climate_identifier'])
+        inputs[str(fpath)] = file_signature(fpath, previous_inputs.get(str(fpath)))
+    recipe_fragment = json.dumps([recipe, kwargs], sort_keys=True, default=str)
+    location_bad_records = json.dumps(
+        {variable: dates.strftime('%Y-%m-%d').tolist()
+         for variable, dates in bad_records.get(recipe['location'], {}).items()},
+        sort_keys=True)
+    return {
+        'recipe': _hash_bytes(recipe_fragment.encode()),
+        'bad_records': _hash_bytes(location_bad_records.encode()),
+        'inputs': inputs,
+        }
+
+
+def _input_hashes(entry):
+    '''Returns content hashes from a manifest entry'''
+    return (entry['recipe'], entry['bad_records'],
+            {fpath: signature and signature['sha256']
+             for fpath, signature in entry['inputs'].items()})
+
+
+def is_up_to_date(recipe, entry, previous):
+    '''True if combined file exists and was built from inputs with the same
+    contents'''
+    if previous is None or not make_csv_filename(recipe['location']).exists():
+        return False
+    if any(signature is None for signature in entry['inputs'].values()):
+        return False
+    return _input_hashes(entry) == _input_hashes(previous)
+
+
+def stream_combined_file(recipe, outfile, bad_records,
+                         chunksize=CSV_CHUNKSIZE):
+    '''Writes combined file by reading station files in chunks, clipping
+    each to its recipe window as it is read and appending it to outfile.
+    Memory use depends on chunksize, not on record length or number of
+    stations.  Missing days, within and between station records, are
+    added as empty records, as in combine_files with reindex_dataframe.
+
+    Station windows must not overlap.
+
+    :recipe: merge recipe for a location
+    :outfile: path to combined file
+    :bad_records: bad records indexed by index_bad_records
+    :chunksize: number of rows to read at a time
+
+    :returns: bad record report as for fix_bad_records
+    '''
+    stations = sorted(recipe['stations'],
+                      key=lambda station: pd.Timestamp(station['start_date']))
+    for previous, station in zip(stations[:-1], stations[1:]):
+        if pd.Timestamp(station['start_date']) <= pd.Timestamp(previous['end_date']):
+            raise ValueError(f'Station windows for {recipe["location"]} overlap, '
+                             'streaming merge needs non-overlapping windows')
+
+    location_bad_records = bad_records.get(recipe['location'], {})
+    report = {variable: {'blanked': 0, 'outside_record': 0}
+              for variable in location_bad_records}
+    first_date = last_date = None
+    tmpfile = Path(outfile).with_name(Path(outfile).name + '.tmp')
+    with open(tmpfile, 'w') as f:
+        for station in stations:
+            filepath = raw_station_filepath(station['climate_identifier'])
+            for chunk in iter_station_file(filepath,
+                                           start=station['start_date'],
+                                           end=station['end_date'],
+                                           chunksize=chunksize):
+                if chunk.empty:
+                    continue
+                # Fill days missing since the end of the last chunk
+                chunk_start = chunk.index[0] if last_date is None else last_date + pd.Timedelta(days=1)
+                chunk = chunk.reindex(pd.date_range(chunk_start, chunk.index[-1], freq='D'))
+                chunk_report = fix_bad_records(chunk, bad_records, recipe['location'])
+                for variable, counts in chunk_report.items():
+                    report[variable]['blanked'] += counts['blanked']
+                chunk.to_csv(f, sep=',', header=first_date is None)
+                if first_date is None:
+                    first_date = chunk.index[0]
+                last_date = chunk.index[-1]
+    os.replace(tmpfile, outfile)
+
+    for variable, dates in location_bad_records.items():
+        in_record = (dates >= first_date) & (dates <= last_date)
+        report[variable]['outside_record'] = int((~in_record).sum())
+    return report
+
+
+def combine_location(recipe, bad_records, save_merged_file=True,
+                     reindex_dataframe=True, verbose=False, streaming=False,
+                     merge_strategy='concat'):
+    '''Combines station files for one recipe, replaces bad records and
+    writes the combined file
+
+    :recipe: merge recipe for a location
+    :bad_records: bad records indexed by index_bad_records
+    :streaming: write combined file with stream_combined_file without
+                holding the record in memory.  Always reindexes.
+    :merge_strategy: one of MERGE_STRATEGIES, see combine_files
+
+    :returns: combined dataframe, or None if streaming
+    '''
+    if verbose: print(f'Combining files for {recipe["location"]}')
+    if streaming and save_merged_file:
+        if recipe.get('merge_strategy', merge_strategy) != 'concat':
+            raise ValueError('Streaming merge only supports the concat strategy')
+        csv_outfile = make_csv_filename(recipe['location'])
+        if verbose: print(f'Streaming combined file to {csv_outfile}')
+        report = stream_combined_file(recipe, csv_outfile, bad_records)
+        if verbose: print_bad_record_report(report)
+        if any(counts['outside_record'] for counts in report.values()):
+            warnings.warn(f'Bad records for {recipe["location"]} include dates '
+                          'outside the combined record')
+        return None
+
+    combined_df, merge_summary = combine_files(recipe,
+                                               reindex_dataframe=reindex_dataframe,
+                                               strategy=merge_strategy,
+                                               return_report=True)
+    if verbose: print_merge_report(merge_summary)
+
+    report = fix_bad_records(combined_df, bad_records, recipe["location"])
+    if verbose: print_bad_record_report(report)
+    if any(counts['outside_record'] for counts in report.values()):
+        warnings.warn(f'Bad records for {recipe["location"]} include dates '
+                      'outside the combined record')
+
+    if save_merged_file:
+        csv_outfile = make_csv_filename(recipe['location'])
+        if verbose: print(f'Writing combined file to {csv_outfile}')
+        combined_df.to_csv(csv_outfile, sep=',')
+
+    return combined_df
+
+
+def inventory_record(location, combined_df=None):
+    '''Returns inventory record for a combined file.  combined_df is read
+    from the file if not given'''
+    return station_record(location, make_csv_filename(location), combined_df)
+
+
+def timed_combine_location(recipe, bad_records, inventory=False, **kwargs):
+    '''Runs combine_location catching any error so that one failed recipe
+    does not stop the others
+
+    :inventory: also make the inventory record for the saved file
+
+    :returns: combined dataframe, or None if combine failed, inventory
+              record or None, and a tuple of location, elapsed time in
+              seconds and error message or None
+    '''
+    start = time.perf_counter()
+    record = None
+    try:
+        combined_df = combine_location(recipe, bad_records, **kwargs)
+        if inventory:
+            record = inventory_record(recipe['location'], combined_df)
+        error = None
+    except Exception as err:
+        combined_df = None
+        error = f'{type(err).__name__}: {err}'
+    return combined_df, record, (recipe['location'], time.perf_counter() - start, error)
+
+
+def _pool_combine_location(recipe, bad_records, **kwargs):
+    '''Worker for process pool.  Only the timing summary and inventory
+    record are returned so the combined dataframe is not pickled back to
+    the parent process'''
+    _, record, summary = timed_combine_location(
+        recipe, bad_records, inventory=kwargs.get('save_merged_file', True),
+        **kwargs)
+    return summary, record
+
+
+def print_timing_summary(results, wall_time):
+    '''Prints time taken and errors for each location to stdout'''
+    print(f'{"Location":20s} {"Time (s)":>8s}  Status')
+    for location, elapsed, error in results:
+        print(f'{location:20s} {elapsed:8.2f}  {error or "ok"}')
+    nfailed = sum(error is not None for _, _, error in results)
+    total = sum(elapsed for _, elapsed, _ in results)
+    print(f'{len(results)} locations combined in {wall_time:.2f} s '
+          f'({total:.2f} s processing), {nfailed} failed')
+    return
+
+
 def make_combined_files(save_merged_file=True, plot_dir='.',
                         verbose=False, make_plot=False, save_plot=False,
-                        reindex_dataframe=True):
+                        reindex_dataframe=True, workers=1, force=False,
+                        streaming=False, merge_strategy='concat'):
     '''Merges station files according to recipes
 
     :save_merged_file: Save combined file (default True).  Set to False
@@ -251,33 +719,110 @@ def make_combined_files(save_merged_file=True, plot_dir='.',
                 window.
     :reindex_dataframe: reindex dataframe to contain full record - set to False for debugging
     :verbose: write progress messages to stdout
+    :workers: number of processes used to combine locations (default 1).  Each
+              recipe is combined independently.  Plots are only made when
+              workers is 1.
+    :force: rebuild all combined files.  Otherwise, when combined files are
+            saved, locations whose raw files, recipe and bad records are
+            unchanged since the last build, as recorded in MANIFEST_PATH,
+            are skipped (default False)
+    :streaming: stream station files to combined files in chunks so
+                memory use does not grow with record length.  Needs
+                non-overlapping station windows and no plots are made
+                (default False)
+    :merge_strategy: how overlapping station records are combined, one
+                     of MERGE_STRATEGIES (default concat).  See
+                     combine_files
+
+    Saved combined files are added to the station inventory, see
+    inventory.py
     '''
     recipes = get_recipe()
 
-    bad_records = get_bad_records_list()
-
-    for recipe in recipes:
-        if verbose: print(f'Combining files for {recipe["location"]}')
-        combined_df = combine_files(recipe,
-                                    reindex_dataframe=reindex_dataframe)
+    bad_records = index_bad_records(get_bad_records_list())
 
-        fix_bad_records(combined_df, bad_records, recipe["location"])
-
-        if save_merged_file:
-            csv_outfile = make_csv_filename(recipe['location'])
-            if verbose: print(f'Writing combined file to {csv_outfile}')
-            combined_df.to_csv(csv_outfile, sep=',')
+    combine_kwargs = {
+        'save_merged_file': save_merged_file,
+        'reindex_dataframe': reindex_dataframe,
+        'verbose': verbose,
+        'streaming': streaming,
+        'merge_strategy': merge_strategy,
+        }
 
+    incremental = save_merged_file and not force
+    manifest = load_manifest() if save_merged_file else {}
+    entries = {}
+    if save_merged_file:
+        stale = []
+        for recipe in recipes:
+            location = recipe['location']
+            entries[location] = location_inputs(
+                recipe, bad_records, previous=manifest.get(location),
+                reindex_dataframe=reindex_dataframe, streaming=streaming,
+                merge_strategy=merge_strategy)
+            if incremental and is_up_to_date(recipe, entries[location],
+                                             manifest.get(location)):
+                if verbose: print(f'{location} is up to date')
+                manifest[location] = entries[location]  # record new mtimes
+                continue
+            stale.append(recipe)
+        recipes = stale
+
+    wall_start = time.perf_counter()
+    if workers > 1:
         if make_plot:
-            fig, ax = plot_variable_time_series(combined_df,
-                                                recipe['location'].upper())
-
-        if make_plot & save_plot:
-            outfile = make_png_filename(recipe["location"], outdir=plot_dir)
-            if verbose: print(f'Saving figure to {outfile}')
-            fig.savefig(outfile)
-        else:
-            plt.show()
+            warnings.warn('Plots are not made when workers > 1')
+        worker = partial(_pool_combine_location, bad_records=bad_records,
+                         **combine_kwargs)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # map returns results in recipe order
+            outputs = list(executor.map(worker, recipes))
+        results = [summary for summary, _ in outputs]
+        records = [record for _, record in outputs if record is not None]
+    else:
+        results = []
+        records = []
+        for recipe in recipes:
+            combined_df, record, summary = timed_combine_location(
+                recipe, bad_records, inventory=save_merged_file,
+                **combine_kwargs)
+            results.append(summary)
+            location = recipe['location']
+            if record is not None:
+                records.append(record)
+
+            if make_plot and combined_df is not None:
+                fig, ax = plot_variable_time_series(combined_df,
+                                                    location.upper())
+                if save_plot:
+                    outfile = make_png_filename(location, outdir=plot_dir)
+                    if verbose: print(f'Saving figure to {outfile}')
+                    fig.savefig(outfile)
+                else:
+                    plt.show()
+
+    if save_merged_file:
+        for location, _, error in results:
+            if error is None:
+                manifest[location] = entries[location]
+            else:
+                manifest.pop(location, None)
+        save_manifest(manifest)
+
+        # Locations built before the inventory existed
+        missing = set(entries) - set(recipe['location'] for recipe in recipes) - inventory_locations()
+        for location in sorted(missing):
+            if not make_csv_filename(location).exists():
+                continue
+            try:
+                records.append(inventory_record(location))
+            except Exception as err:
+                warnings.warn(f'{location} not added to inventory: '
+                              f'{type(err).__name__}: {err}')
+        update_inventory(records)
+
+    print_timing_summary(results, time.perf_counter() - wall_start)
+    return results
 
 
 if __name__ == "__main__":
@@ -294,6 +839,14 @@ if __name__ == "__main__":
                         help='Save plot as png')
     parser.add_argument('--reindex_dataframe', action='store_false',
                         help='do not reindex dataframe')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of processes used to combine locations (default 1)')
+    parser.add_argument('--force', action='store_true',
+                        help='Rebuild all combined files, including those with unchanged inputs')
+    parser.add_argument('--streaming', action='store_true',
+                        help='Stream station files to combined files in chunks to bound memory use')
+    parser.add_argument('--merge_strategy', choices=MERGE_STRATEGIES, default='concat',
+                        help='How overlapping station records are combined (default concat)')
     parser.add_argument('--verbose', '-v', action='store_true')
 
     args = parser.parse_args()
@@ -303,4 +856,8 @@ if __name__ == "__main__":
                         make_plot=args.make_plot,
                         save_plot=args.save_plot,
                         reindex_dataframe=args.reindex_dataframe,
-                        verbose=args.verbose)
+                        verbose=args.verbose,
+                        workers=args.workers,
+                        force=args.force,
+                        streaming=args.streaming,
+                        merge_strategy=args.merge_strategy)
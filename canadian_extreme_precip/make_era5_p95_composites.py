@@ -0,0 +1,127 @@
+"""Makes composites of daily ERA5 anomalies on days with precipitation greater
+than the 95th percentile at each station"""
+
+from canadian_extreme_precip.era5 import (ERA5_CHUNKS,
+                                          ERA5_SURFACE_DAILY_PATH,
+                                          ERA5_PRESSURE_LEVEL_DAILY_PATH,
+                                          era5_filelist,
+                                          open_era5,
+                                          open_climatology,
+                                          climatology_filepath,
+                                          write_product,
+                                          region_suffix,
+                                          COMPLEVEL,
+                                          add_scheduler_arguments,
+                                          add_region_arguments,
+                                          add_output_arguments)
+from canadian_extreme_precip.era5_composites import composite_anomalies, BATCH_SIZE
+from canadian_extreme_precip.make_era5_station_series import PRODUCTS
+from canadian_extreme_precip.make_era5_thickness_climatology import add_thickness
+from canadian_extreme_precip.get_precipitation_quantiles import load_precip_panel
+from canadian_extreme_precip.get_p95_events import exceedance_events
+
+year_start = 1980
+year_end = 2010
+
+# Daily mean files for each product, fields on event days are read from
+# these.  Climatologies are the monthly climatologies of PRODUCTS
+DAILY_PRODUCTS = {
+    'surface': (ERA5_SURFACE_DAILY_PATH, 'era5.single_levels.daily', None),
+    'thickness': (ERA5_PRESSURE_LEVEL_DAILY_PATH, 'era5.pressure_levels.daily', add_thickness),
+    }
+
+
+def make_era5_p95_composites(product='surface', year_start=year_start,
+                             year_end=year_end,
+                             climatology_start=year_start,
+                             climatology_end=year_end,
+                             percentile=0.95, stations=None,
+                             bbox=None, min_latitude=None,
+                             batch_size=BATCH_SIZE, scheduler='threads',
+                             workers=None, fmt='netcdf', complevel=COMPLEVEL,
+                             verbose=False):
+    """Makes composites of daily anomalies for exceedance events between
+    year_start and year_end.  Fields on event days are read from the
+    daily files in DAILY_PRODUCTS.  Anomalies are from the monthly
+    climatology for climatology_start to climatology_end made by
+    make_era5_*_climatology for the same region.
+
+    :product: one of DAILY_PRODUCTS
+    :percentile: percentile as a fraction
+    :stations: list of stations (default all stations)
+    :batch_size: number of time steps read at once
+    :scheduler: dask scheduler, see era5.compute
+    :workers: number of threads or processes
+
+    :returns: path to file written
+
+    :raises FileNotFoundError: if daily files or the climatology are missing
+    """
+    daily_path, daily_prefix, prepare = DAILY_PRODUCTS[product]
+    filelist = era5_filelist(daily_path, daily_prefix, year_start, year_end)
+    missing = [f for f in filelist if not f.exists()]
+    if missing:
+        raise FileNotFoundError(f'Composites need daily ERA5 files, {len(missing)} '
+                                f'not found, e.g. {missing[0]}')
+    path, prefix, _ = PRODUCTS[product]
+    climatology_file = climatology_filepath(path, prefix, climatology_start,
+                                            climatology_end, bbox=bbox,
+                                            min_latitude=min_latitude)
+    if not (climatology_file.exists() or climatology_file.with_suffix('.zarr').exists()):
+        raise FileNotFoundError(f'{climatology_file} not found, make it with '
+                                f'make_era5_{product}_climatology')
+
+    events = exceedance_events(load_precip_panel(stations), percentile=percentile,
+                               start=str(year_start), end=str(year_end))
+    if verbose: print(f'Found {len(events)} events')
+
+    # One time step in each chunk so only time steps with events are read
+    ds = open_era5(filelist, chunks=dict(ERA5_CHUNKS, time=1),
+                   bbox=bbox, min_latitude=min_latitude)
+    if prepare is not None:
+        ds = prepare(ds)
+    climatology = open_climatology(climatology_file)
+
+    composites = composite_anomalies(ds, climatology, events,
+                                     batch_size=batch_size,
+                                     scheduler=scheduler, workers=workers,
+                                     verbose=verbose)
+    composites.attrs['percentile'] = percentile
+    composites.attrs['climatology'] = f'{climatology_start} to {climatology_end}'
+
+    name = f"p{percentile * 100:g}_composites"
+    suffix = region_suffix(bbox, min_latitude)
+    outfile = daily_path / f"{daily_prefix}.{name}.{year_start}to{year_end}{suffix}.nc"
+    return write_product(composites, outfile, fmt=fmt, complevel=complevel)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Makes composites of ERA5 anomalies on P95 event days')
+    parser.add_argument('--product', choices=list(DAILY_PRODUCTS), default='surface')
+    parser.add_argument('--year_start', type=int, default=year_start)
+    parser.add_argument('--year_end', type=int, default=year_end)
+    parser.add_argument('--climatology_start', type=int, default=year_start)
+    parser.add_argument('--climatology_end', type=int, default=year_end)
+    parser.add_argument('--percentile', type=float, default=0.95,
+                        help='Percentile as a fraction (default 0.95)')
+    parser.add_argument('--batch_size', type=int, default=BATCH_SIZE,
+                        help=f'Number of time steps read at once (default {BATCH_SIZE})')
+    parser.add_argument('--verbose', action='store_true')
+    add_region_arguments(parser)
+    add_output_arguments(parser)
+    add_scheduler_arguments(parser)
+
+    args = parser.parse_args()
+
+    make_era5_p95_composites(product=args.product, year_start=args.year_start,
+                             year_end=args.year_end,
+                             climatology_start=args.climatology_start,
+                             climatology_end=args.climatology_end,
+                             percentile=args.percentile,
+                             bbox=args.bbox, min_latitude=args.min_latitude,
+                             batch_size=args.batch_size,
+                             scheduler=args.scheduler, workers=args.workers,
+                             fmt=args.fmt, complevel=args.complevel,
+                             verbose=args.verbose)
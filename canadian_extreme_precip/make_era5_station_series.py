@@ -0,0 +1,68 @@
+"""Makes time series of ERA5 fields at station locations"""
+
+from canadian_extreme_precip.era5 import (ERA5_SURFACE_PATH,
+                                          ERA5_PRESSURE_LEVEL_PATH,
+                                          ERA5_SURFACE_DAILY_PATH,
+                                          ERA5_PRESSURE_LEVEL_DAILY_PATH,
+                                          era5_filelist,
+                                          open_era5,
+                                          compute,
+                                          add_scheduler_arguments)
+from canadian_extreme_precip.era5_stations import sample_stations, METHODS
+from canadian_extreme_precip.make_era5_thickness_climatology import add_thickness
+
+year_start = 1980
+year_end = 2010
+
+# Path, file prefix and function applied to the dataset for each product
+PRODUCTS = {
+    'surface': (ERA5_SURFACE_PATH, 'era5.single_levels.monthly', None),
+    'thickness': (ERA5_PRESSURE_LEVEL_PATH, 'era5.pressure_levels.monthly', add_thickness),
+    'surface_daily': (ERA5_SURFACE_DAILY_PATH, 'era5.single_levels.daily', None),
+    'thickness_daily': (ERA5_PRESSURE_LEVEL_DAILY_PATH, 'era5.pressure_levels.daily', add_thickness),
+    }
+
+
+def make_era5_station_series(product='surface', year_start=year_start,
+                             year_end=year_end, method='nearest',
+                             scheduler='threads', workers=None, progress=True):
+    """Samples ERA5 files at every station and writes time series
+
+    :product: one of PRODUCTS
+    :method: nearest or bilinear
+    :scheduler: dask scheduler, see era5.compute
+    :workers: number of threads or processes
+    :progress: show progress bar
+
+    :returns: path to file written
+    """
+    path, prefix, prepare = PRODUCTS[product]
+    ds = open_era5(era5_filelist(path, prefix, year_start, year_end))
+    if prepare is not None:
+        ds = prepare(ds)
+
+    points = compute(sample_stations(ds, method=method),
+                     scheduler=scheduler, workers=workers, progress=progress)
+    outfile = path / f"{prefix}.stations.{method}.{year_start}to{year_end}.nc"
+    points.to_netcdf(outfile)
+    return outfile
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Makes time series of ERA5 fields at station locations')
+    parser.add_argument('--product', choices=list(PRODUCTS), default='surface',
+                        help='Monthly means, or daily means with _daily (default surface)')
+    parser.add_argument('--year_start', type=int, default=year_start)
+    parser.add_argument('--year_end', type=int, default=year_end)
+    parser.add_argument('--method', choices=METHODS, default='nearest',
+                        help='Nearest grid cell or bilinear interpolation (default nearest)')
+    add_scheduler_arguments(parser)
+
+    args = parser.parse_args()
+
+    make_era5_station_series(product=args.product, year_start=args.year_start,
+                             year_end=args.year_end, method=args.method,
+                             scheduler=args.scheduler, workers=args.workers,
+                             progress=not args.no_progress)
@@ -7,22 +7,34 @@ Here we calculate 500 hPa thickness which is defined as:
 Thickness is calculated for each month and the monthly means calculated
 """
 
-from pathlib import Path
+from functools import partial
 
-import xarray as xr
+from canadian_extreme_precip.era5 import (ERA5_PRESSURE_LEVEL_PATH,
+                                          era5_filelist,
+                                          open_era5,
+                                          monthly_climatology,
+                                          write_climatology,
+                                          write_product,
+                                          COMPLEVEL,
+                                          region_suffix,
+                                          climatology_filepath,
+                                          add_scheduler_arguments,
+                                          add_region_arguments,
+                                          add_output_arguments)
+from canadian_extreme_precip.era5_accumulators import (set_years,
+                                                       climatology_from_accumulators)
 
 year_start = 1980
 year_end = 2010
 
-path = Path('/', 'projects', 'AROSS', 'Reanalysis', 'ERA5', 'pressure_levels', 'monthly')
+path = ERA5_PRESSURE_LEVEL_PATH
+prefix = "era5.pressure_levels.monthly"
 
 g = 9.80665
 
-def make_era5_thickness_climatology():
-    """Makes climatology files"""
 
-    filelist = [path / f"era5.pressure_levels.monthly.{y}.nc" for y in range(year_start, year_end+1)]
-    ds = xr.open_mfdataset(filelist, combine="by_coords")
+def add_thickness(ds):
+    """Adds 500 hPa thickness to geopotential dataset"""
     ds['thickness'] = (ds.z.sel(level=500) - ds.z.sel(level=1000)) / g
     ds['thickness'].attrs = {
         'units': 'm',
@@ -30,10 +42,77 @@ def make_era5_thickness_climatology():
         'standard_name': 'atmosphere_layer_thickness_expressed_as_geopotential_height_difference',
         'level': '500 hPa'
         }
-    
-    ds_clim = ds.groupby(ds.time.dt.month).mean(keep_attrs=True)
-    ds_clim.to_netcdf(path / f"era5.pressure_levels.monthly.climatology.{year_start}to{year_end}.nc")
+    return ds
+
+
+def accumulator_filepath(bbox=None, min_latitude=None):
+    """Returns path to accumulator store for a region"""
+    return path / f"{prefix}.accumulators{region_suffix(bbox, min_latitude)}.nc"
+
+
+def open_year(year, bbox=None, min_latitude=None):
+    """Opens file for one year and adds thickness"""
+    return add_thickness(open_era5(era5_filelist(path, prefix, year, year),
+                                   bbox=bbox, min_latitude=min_latitude))
+
+
+def make_era5_thickness_climatology(year_start=year_start, year_end=year_end,
+                                    scheduler='threads', workers=None,
+                                    progress=True, incremental=False,
+                                    bbox=None, min_latitude=None,
+                                    fmt='netcdf', complevel=COMPLEVEL):
+    """Makes climatology files
+
+    :scheduler: dask scheduler, see era5.compute
+    :workers: number of threads or processes
+    :progress: show progress bar
+    :incremental: derive climatology from accumulator store, reading only
+                  years that are not already in the store.  See
+                  era5_accumulators.py
+    :bbox: only process (lon_min, lat_min, lon_max, lat_max)
+    :min_latitude: only process north of min_latitude
+    :fmt: output format, netcdf or zarr, see era5.write_product
+    :complevel: netCDF compression level
+    """
+    outfile = climatology_filepath(path, prefix, year_start, year_end,
+                                   bbox=bbox, min_latitude=min_latitude)
+
+    if incremental:
+        acc = set_years(accumulator_filepath(bbox, min_latitude),
+                        range(year_start, year_end+1),
+                        partial(open_year, bbox=bbox, min_latitude=min_latitude),
+                        scheduler=scheduler, workers=workers, progress=progress)
+        write_product(climatology_from_accumulators(acc), outfile,
+                      fmt=fmt, complevel=complevel)
+        return
+
+    filelist = era5_filelist(path, prefix, year_start, year_end)
+    ds = add_thickness(open_era5(filelist, bbox=bbox, min_latitude=min_latitude))
+
+    ds_clim = monthly_climatology(ds)
+    write_climatology(ds_clim, outfile,
+                      scheduler=scheduler, workers=workers, progress=progress,
+                      fmt=fmt, complevel=complevel)
 
 
 if __name__ == "__main__":
-    make_era5_thickness_climatology()
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Makes ERA5 500 hPa thickness climatology')
+    parser.add_argument('--year_start', type=int, default=year_start)
+    parser.add_argument('--year_end', type=int, default=year_end)
+    parser.add_argument('--incremental', action='store_true',
+                        help='Update monthly accumulators with years added to or '
+                        'removed from the baseline and make climatology from them')
+    add_region_arguments(parser)
+    add_output_arguments(parser)
+    add_scheduler_arguments(parser)
+
+    args = parser.parse_args()
+
+    make_era5_thickness_climatology(year_start=args.year_start, year_end=args.year_end,
+                                    scheduler=args.scheduler, workers=args.workers,
+                                    progress=not args.no_progress,
+                                    incremental=args.incremental,
+                                    bbox=args.bbox, min_latitude=args.min_latitude,
+                                    fmt=args.fmt, complevel=args.complevel)
@@ -1,19 +1,110 @@
 '''Creates fixed width files showing temperature and precipitation data'''
 
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import os
+import time
 
 from canadian_extreme_precip.reader import read_combined_file
 from canadian_extreme_precip.write_files import write_formatted_data
 from canadian_extreme_precip.filepath import COMBINED_PATH
+from canadian_extreme_precip.storage import list_files, file_stat
 
 
-def make_one_file(fpath):
-    outfile = fpath.name.replace('.csv', '.for_qc.txt')
+def make_qc_filename(fpath, outdir='.'):
+    '''Returns path to fixed width file for a combined file'''
+    return Path(outdir) / fpath.name.replace('.csv', '.for_qc.txt')
+
+
+def is_up_to_date(fpath, outfile):
+    '''True if outfile exists and is newer than the combined file'''
+    return outfile.exists() and outfile.stat().st_mtime >= file_stat(fpath).st_mtime
+
+
+def make_one_file(fpath, outdir='.'):
+    '''Writes fixed width file for a combined file.  The file is written
+    under a temporary name and renamed when complete so an interrupted run
+    never leaves a partial file that looks up to date'''
+    outfile = make_qc_filename(fpath, outdir)
+    tmpfile = outfile.with_name(outfile.name + '.tmp')
     df = read_combined_file(fpath)
-    write_formatted_data(df, outfile)
+    write_formatted_data(df, tmpfile)
+    os.replace(tmpfile, outfile)
+    return outfile
+
+
+def timed_make_one_file(fpath, outdir='.'):
+    '''Runs make_one_file catching any error so that one bad file does
+    not stop the others
+
+    :returns: file name, elapsed time in seconds and error message or None
+    '''
+    start = time.perf_counter()
+    try:
+        make_one_file(fpath, outdir=outdir)
+        error = None
+    except Exception as err:
+        error = f'{type(err).__name__}: {err}'
+    return fpath.name, time.perf_counter() - start, error
+
+
+def print_timing_summary(results, nskipped, wall_time):
+    '''Prints time taken and errors for each file to stdout'''
+    for name, elapsed, error in results:
+        print(f'{name:40s} {elapsed:8.2f}  {error or "ok"}')
+    nfailed = sum(error is not None for _, _, error in results)
+    total = sum(elapsed for _, elapsed, _ in results)
+    print(f'{len(results)} files written in {wall_time:.2f} s '
+          f'({total:.2f} s processing), {nskipped} up to date, {nfailed} failed')
+    return
+
+
+def make_formatted_files_for_qc(outdir='.', workers=1, force=False,
+                                verbose=False):
+    '''Writes fixed width files for all combined files
+
+    :outdir: output directory (default cwd)
+    :workers: number of processes (default 1)
+    :force: rewrite files that are newer than their combined file
+            (default False)
+    :verbose: write progress messages to stdout
+    '''
+    Path(outdir).mkdir(parents=True, exist_ok=True)
+    filelist = list_files(COMBINED_PATH, '*.csv')
+    todo = [f for f in filelist
+            if force or not is_up_to_date(f, make_qc_filename(f, outdir))]
+    if verbose: print(f'{len(filelist) - len(todo)} of {len(filelist)} files are up to date')
+
+    wall_start = time.perf_counter()
+    if workers > 1:
+        worker = partial(timed_make_one_file, outdir=outdir)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(worker, todo))
+    else:
+        results = []
+        for f in todo:
+            if verbose: print(f'Processing {f.name}')
+            results.append(timed_make_one_file(f, outdir=outdir))
+
+    print_timing_summary(results, len(filelist) - len(todo),
+                         time.perf_counter() - wall_start)
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Writes fixed width files of combined station data for QC')
+    parser.add_argument('--outdir', type=str, default='.',
+                        help='Directory to write files to (default cwd)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of processes (default 1)')
+    parser.add_argument('--force', action='store_true',
+                        help='Rewrite files that are up to date')
+    parser.add_argument('--verbose', '-v', action='store_true')
 
+    args = parser.parse_args()
 
-for f in COMBINED_PATH.glob('*.csv'):
-    print(f'Processing {f.name}')
-    make_one_file(f)
-    
+    make_formatted_files_for_qc(outdir=args.outdir, workers=args.workers,
+                                force=args.force, verbose=args.verbose)
@@ -1,18 +1,38 @@
 '''Generates a JSON file that contains climate identifiers and start and end 
 dates used to combine station records'''
 
-from pathlib import Path
+import io
+import os
 import re
 import pprint
 import json
 
+import numpy as np
 import pandas as pd
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
 
-# Path to combined data file from Mark
-DATAPATH = Path('/', 'home', 'apbarret', 'Data',
-                'Rain_on_snow',
-                'Canada_extreme_precip',
-                'From_Mark')
+from canadian_extreme_precip.filepath import RAW_STATION_PATH, MARK_PATH
+from canadian_extreme_precip.storage import open_file, list_files
+
+EARTH_RADIUS_KM = 6371.
+# Stations closer than this are treated as the same location
+STATION_SEARCH_RADIUS_KM = 25.
+
+# Station name suffixes that are not part of the location name, e.g.
+# ALERT CLIMATE, PANGNIRTUNG A
+STATION_NAME_SUFFIX = re.compile(r'(\s+(A|AWOS|CS|CLIMATE|RCS|AUTO|AUT))+$')
+
+# Column names in ECCC Station Inventory csv
+INVENTORY_COLUMNS = {
+    'Name': 'STATION_NAME',
+    'Climate ID': 'CLIMATE_IDENTIFIER',
+    'Latitude (Decimal Degrees)': 'y',
+    'Longitude (Decimal Degrees)': 'x',
+    'DLY First Year': 'START_YEAR',
+    'DLY Last Year': 'END_YEAR',
+    }
 
 
 def get_filelist():
@@ -21,7 +41,7 @@ def get_filelist():
     p2 = re.compile('.*(?=\.+csv)')
 
     data = {}
-    for fp in DATAPATH.glob('*.csv'):
+    for fp in list_files(MARK_PATH, '*.csv'):
         m1 = p1.search(fp.name)
         if m1:
             station_name = m1.group(0)
@@ -43,7 +63,8 @@ def get_filelist():
 
 def load_data(filepath):
     '''Loads a combined file'''
-    df = pd.read_csv(filepath, skiprows=2)
+    with open_file(filepath) as f:
+        df = pd.read_csv(f, skiprows=2)
     df = df.dropna(how='all')
     return df
 
@@ -69,6 +90,173 @@ def get_station_metadata(df):
     return metadata
 
 
+def _last_line(fpath, blocksize=4096):
+    '''Returns last line of a text file without reading the whole file'''
+    with open_file(fpath) as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(size - blocksize, 0))
+        lines = f.read().splitlines()
+    return lines[-1].decode()
+
+
+def raw_station_metadata(filelist=None):
+    '''Gets station name, coordinates and first and last dates from raw
+    station files.  Only the header, first record and last record of each
+    file are read.
+
+    :filelist: list of raw station files (default all files in
+               RAW_STATION_PATH)
+
+    :returns: pandas dataframe indexed by CLIMATE_IDENTIFIER'''
+    if filelist is None:
+        filelist = list_files(RAW_STATION_PATH, '*_climate_daily.csv')
+    columns = ['x', 'y', 'STATION_NAME', 'CLIMATE_IDENTIFIER', 'LOCAL_DATE']
+    records = []
+    for fp in filelist:
+        with open_file(fp) as f:
+            header = f.readline().decode()
+            first = f.readline().decode()
+        if not first:
+            continue
+        df = pd.read_csv(io.StringIO(header + first + _last_line(fp) + '\n'),
+                         usecols=columns)
+        records.append(df.iloc[0][['x', 'y', 'STATION_NAME', 'CLIMATE_IDENTIFIER']]
+                       .to_dict() | {'START_DATE': df.LOCAL_DATE.iloc[0],
+                                     'END_DATE': df.LOCAL_DATE.iloc[-1]})
+    metadata = pd.DataFrame(records).set_index('CLIMATE_IDENTIFIER')
+    metadata['START_DATE'] = pd.to_datetime(metadata['START_DATE']).dt.normalize()
+    metadata['END_DATE'] = pd.to_datetime(metadata['END_DATE']).dt.normalize()
+    return metadata
+
+
+def read_station_inventory(fpath, skiprows=3):
+    '''Reads ECCC Station Inventory csv.  Only first and last years of
+    daily data are given in the inventory so records are assumed to cover
+    whole years.  Stations without daily data are dropped.
+
+    :fpath: path to inventory file
+    :skiprows: number of lines before header (default 3)
+
+    :returns: pandas dataframe indexed by CLIMATE_IDENTIFIER'''
+    df = pd.read_csv(fpath, skiprows=skiprows, usecols=list(INVENTORY_COLUMNS),
+                     dtype={'Climate ID': str})
+    df = df.rename(INVENTORY_COLUMNS, axis=1)
+    df = df.dropna(subset=['START_YEAR', 'END_YEAR'])
+    df['START_DATE'] = pd.to_datetime(df.START_YEAR.astype(int).astype(str) + '-01-01')
+    df['END_DATE'] = pd.to_datetime(df.END_YEAR.astype(int).astype(str) + '-12-31')
+    return df.drop(['START_YEAR', 'END_YEAR'], axis=1).set_index('CLIMATE_IDENTIFIER')
+
+
+def group_stations(metadata, radius_km=STATION_SEARCH_RADIUS_KM):
+    '''Groups stations within radius_km of each other into locations.
+    Station coordinates are converted to points on a unit sphere so that
+    distances in a KD-tree are chord lengths.  Groups are connected
+    components of the graph of station pairs within the radius, so a
+    chain of nearby stations is one location.
+
+    :metadata: dataframe with x (longitude) and y (latitude) columns
+    :radius_km: search radius in km
+
+    :returns: numpy array of group labels for each station'''
+    lon = np.radians(metadata.x.values)
+    lat = np.radians(metadata.y.values)
+    points = np.column_stack([np.cos(lat) * np.cos(lon),
+                              np.cos(lat) * np.sin(lon),
+                              np.sin(lat)])
+    chord = 2. * np.sin(radius_km / EARTH_RADIUS_KM / 2.)
+    pairs = cKDTree(points).query_pairs(chord, output_type='ndarray')
+    nstation = len(metadata)
+    graph = coo_matrix((np.ones(len(pairs)), (pairs[:, 0], pairs[:, 1])),
+                       shape=(nstation, nstation))
+    _, labels = connected_components(graph, directed=False)
+    return labels
+
+
+def clip_coverage(metadata, labels=None):
+    '''Clips station records for each location so they do not overlap.
+    Stations are taken in order of start date, each starting the day after
+    the latest end date of earlier stations at the location.  Stations whose
+    records are covered by earlier stations are dropped.
+
+    :metadata: dataframe of stations with START_DATE and END_DATE
+    :labels: location label of each station from group_stations (default
+             all stations are at one location)
+
+    :returns: dataframe of stations with clipped START_DATE and LOCATION
+              column, sorted by location and start date'''
+    if labels is None:
+        labels = np.zeros(len(metadata), dtype=int)
+    metadata = metadata.assign(LOCATION=labels)
+    metadata = metadata.sort_values(['LOCATION', 'START_DATE', 'END_DATE'],
+                                    ascending=[True, True, False])
+    covered_to = (metadata.groupby('LOCATION').END_DATE.cummax()
+                  .groupby(metadata.LOCATION).shift(1))
+    start = metadata.START_DATE.where(
+        covered_to.isna() | (metadata.START_DATE > covered_to),
+        covered_to + pd.Timedelta(days=1))
+    metadata = metadata.assign(START_DATE=start)
+    return metadata[metadata.START_DATE <= metadata.END_DATE]
+
+
+def location_names(metadata, labels):
+    '''Returns location names from name of station with longest record at
+    each location.  Names are made unique by adding the climate identifier.
+
+    :returns: pandas series of names indexed by label'''
+    duration = (metadata.END_DATE - metadata.START_DATE).values
+    order = np.lexsort((-duration.astype('int64'), labels))
+    longest = order[np.r_[True, np.diff(labels[order]) != 0]]
+    names = (metadata.STATION_NAME.iloc[longest].str.strip()
+             .str.replace(STATION_NAME_SUFFIX, '', regex=True).str.lower())
+    names.index = labels[longest]
+    duplicated = names.duplicated(keep=False)
+    ids = metadata.index[longest].astype(str)
+    return names.where(~duplicated, names + ' ' + ids)
+
+
+def recipes_from_metadata(metadata, radius_km=STATION_SEARCH_RADIUS_KM):
+    '''Generates merge recipes in station_merge_recipe.json format from
+    station metadata from raw_station_metadata or read_station_inventory
+
+    :metadata: dataframe indexed by CLIMATE_IDENTIFIER with x, y,
+               STATION_NAME, START_DATE and END_DATE
+    :radius_km: search radius for stations at the same location
+
+    :returns: list of recipes sorted by location'''
+    labels = group_stations(metadata, radius_km=radius_km)
+    names = location_names(metadata, labels)
+    clipped = clip_coverage(metadata, labels)
+
+    recipes = {}
+    for label, climate_identifier, start_date, end_date in zip(
+            clipped.LOCATION.values, clipped.index,
+            clipped.START_DATE.dt.strftime('%Y-%m-%d'),
+            clipped.END_DATE.dt.strftime('%Y-%m-%d')):
+        recipes.setdefault(label, []).append({
+            'climate_identifier': climate_identifier,
+            'start_date': start_date,
+            'end_date': end_date,
+            })
+    return sorted(({'location': names[label], 'stations': stations}
+                   for label, stations in recipes.items()),
+                  key=lambda r: r['location'])
+
+
+def _json_default(obj):
+    '''Converts numpy integers when writing json'''
+    if isinstance(obj, np.integer):
+        return int(obj)
+    raise TypeError(f'{type(obj).__name__} is not JSON serializable')
+
+
+def write_recipes(recipes, outfile):
+    '''Writes recipes to json'''
+    with open(outfile, 'w') as f:
+        f.write(json.dumps(recipes, indent=4, default=_json_default))
+    return
+
+
 def make_station_merge_recipes():
     '''Generates JSON with station merge recipes'''
     filedict = get_filelist()
@@ -119,4 +307,34 @@ def make_station_merge_recipes():
 
 
 if __name__ == "__main__":
-    make_station_merge_recipes()
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Generates station merge recipes')
+    parser.add_argument('--source', choices=['raw', 'inventory', 'mark'], default='mark',
+                        help='Generate recipes from raw station files, an ECCC '
+                        'station inventory or combined files from Mark (default mark)')
+    parser.add_argument('--inventory', type=str, default=None,
+                        help='Path to ECCC Station Inventory csv, for --source inventory')
+    parser.add_argument('--radius', type=float, default=STATION_SEARCH_RADIUS_KM,
+                        help='Stations within radius km are combined (default '
+                        f'{STATION_SEARCH_RADIUS_KM:.0f})')
+    parser.add_argument('--outfile', type=str,
+                        default='dataset_preparation/station_merge_recipe.json',
+                        help='Path to output json, for --source raw or inventory')
+    parser.add_argument('--force', action='store_true',
+                        help='Overwrite outfile if it exists')
+
+    args = parser.parse_args()
+
+    if args.source == 'mark':
+        make_station_merge_recipes()
+    elif os.path.exists(args.outfile) and not args.force:
+        parser.error(f'{args.outfile} exists, use --force to overwrite it')
+    else:
+        if args.source == 'inventory':
+            metadata = read_station_inventory(args.inventory)
+        else:
+            metadata = raw_station_metadata()
+        recipes = recipes_from_metadata(metadata, radius_km=args.radius)
+        write_recipes(recipes, args.outfile)
+        print(f'{len(recipes)} recipes from {len(metadata)} stations written to {args.outfile}')
@@ -0,0 +1,57 @@
+'''Loads combined files for many stations into a single panel so that
+statistics can be calculated for all stations with one groupby'''
+
+import pandas as pd
+
+from canadian_extreme_precip.reader import (read_combined_file,
+                                            read_station_locations,
+                                            to_compact)
+from canadian_extreme_precip.filepath import (combined_station_filepath,
+                                              STATION_FILEPATH)
+
+
+def station_list(exclude=None):
+    '''Returns list of station names in station locations file
+
+    :exclude: list of stations to leave out
+    '''
+    stations = read_station_locations(STATION_FILEPATH).index.tolist()
+    return [s for s in stations if s not in (exclude or [])]
+
+
+def load_panel(stations=None, columns=None, start=None, end=None,
+               compact=False):
+    '''Loads combined files for stations into a long format dataframe
+    indexed by station and date
+
+    :stations: list of station names (default all stations in station
+               locations file)
+    :columns: list of columns to load (default all)
+    :start: first date to load (default start of each record)
+    :end: last date to load (default end of each record)
+    :compact: return the compact layout of to_compact (default False)
+
+    :returns: pandas dataframe with (station, date) MultiIndex
+    '''
+    if stations is None:
+        stations = station_list()
+    frames = {station: read_combined_file(combined_station_filepath(station),
+                                          columns=columns,
+                                          start=start, end=end,
+                                          compact=compact)
+              for station in stations}
+    panel = pd.concat(frames, names=['station', 'date'])
+    if compact:
+        # Flags share FLAG_DTYPE but station names differ between stations
+        # so are concatenated as objects
+        panel = to_compact(panel)
+    return panel
+
+
+def to_dataset(panel):
+    '''Converts a long format panel to an xarray Dataset with station and
+    time dimensions.  Flag columns are stored as objects.'''
+    df = panel.rename_axis(['station', 'time'])
+    for column in df.select_dtypes('category'):
+        df[column] = df[column].astype(object)
+    return df.to_xarray()
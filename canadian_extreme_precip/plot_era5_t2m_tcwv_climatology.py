@@ -1,21 +1,25 @@
 """Plots T2m and TCWV July climatology for paper"""
 
-from pathlib import Path
-
 import numpy as np
 
-import xarray as xr
-
 import matplotlib.pyplot as plt
 from matplotlib import cm
 from matplotlib.colors import ListedColormap
 
 import cartopy.crs as ccrs
 
+from era5 import (ERA5_SURFACE_PATH,
+                  climatology_filepath,
+                  open_climatology,
+                  add_region_arguments,
+                  OUTPUT_FORMATS)
 from plotting import plot_panarctic_panel
 
-datafile = Path('/projects/AROSS/Reanalysis/ERA5/surface/monthly/',
-                'era5.single_levels.monthly.climatology.1980to2010.nc')
+path = ERA5_SURFACE_PATH
+prefix = "era5.single_levels.monthly"
+
+year_start = 1980
+year_end = 2010
 
 cbar_kwargs = {'shrink': 0.95, 'orientation': 'horizontal', 'pad': 0.05}
 
@@ -28,22 +32,26 @@ tcwv_cmap = cm.get_cmap('viridis_r', 256)
 tcwv_cmap = ListedColormap(tcwv_cmap(np.linspace(0.0, 0.8, 256)))
 
 
-def plot_era5_t2m_tcwv_climatology():
-    """Plots climatology figure"""
+def plot_era5_t2m_tcwv_climatology(year_start=year_start, year_end=year_end,
+                                   bbox=None, min_latitude=None, fmt='netcdf'):
+    """Plots climatology figure from the climatology file written by
+    make_era5_*_climatology for the same years, region and format"""
 
-    ds = xr.open_dataset(datafile)
+    datafile = climatology_filepath(path, prefix, year_start, year_end,
+                                    bbox=bbox, min_latitude=min_latitude, fmt=fmt)
+    ds = open_climatology(datafile, month=7)
     ds["t2m"] = ds.t2m - 273.15
 
     fig = plt.figure(figsize=(10,7))
 
     ax1 = plot_panarctic_panel(fig, 122)
     cbar_kwargs['label'] = '$^\circ$C'
-    ds.t2m.sel(month=7).plot.contourf(ax=ax1,
-                                      transform=ccrs.PlateCarree(),
-                                      center=0., vmin=-20., vmax=20.,
-                                      levels=np.arange(-16, 17, 4),
-                                      cmap=t2m_cmap,
-                                      cbar_kwargs=cbar_kwargs,)
+    ds.t2m.plot.contourf(ax=ax1,
+                         transform=ccrs.PlateCarree(),
+                         center=0., vmin=-20., vmax=20.,
+                         levels=np.arange(-16, 17, 4),
+                         cmap=t2m_cmap,
+                         cbar_kwargs=cbar_kwargs,)
     ax1.set_title('')
     ax1.text(0.02, 0.98, 'b) $T_{2m}$',
              transform=ax1.transAxes,
@@ -54,12 +62,12 @@ def plot_era5_t2m_tcwv_climatology():
     
     ax2 = plot_panarctic_panel(fig, 121)
     cbar_kwargs['label'] = 'kg m$^{-2}$'
-    ds.tcwv.sel(month=7).plot.contourf(ax=ax2,
-                                       transform=ccrs.PlateCarree(),
-                                       vmin=0, vmax=50,
-                                       levels=np.arange(0, 22, 2),
-                                       cmap=tcwv_cmap,
-                                       cbar_kwargs=cbar_kwargs,)
+    ds.tcwv.plot.contourf(ax=ax2,
+                          transform=ccrs.PlateCarree(),
+                          vmin=0, vmax=50,
+                          levels=np.arange(0, 22, 2),
+                          cmap=tcwv_cmap,
+                          cbar_kwargs=cbar_kwargs,)
     ax2.set_title('')
     ax2.text(0.02, 0.98, 'a) Prec. Water.',
              transform=ax2.transAxes,
@@ -72,4 +80,16 @@ def plot_era5_t2m_tcwv_climatology():
 
 
 if __name__ == "__main__":
-    plot_era5_t2m_tcwv_climatology()
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Plots July ERA5 climatology')
+    parser.add_argument('--year_start', type=int, default=year_start)
+    parser.add_argument('--year_end', type=int, default=year_end)
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, default='netcdf',
+                        dest='fmt', help='Format of climatology file (default netcdf)')
+    add_region_arguments(parser)
+
+    args = parser.parse_args()
+
+    plot_era5_t2m_tcwv_climatology(year_start=args.year_start, year_end=args.year_end,
+                                   bbox=args.bbox, min_latitude=args.min_latitude, fmt=args.fmt)
@@ -1,9 +1,6 @@
 """Plots T2m and TCWV July climatology for paper"""
 
-from pathlib import Path
-
 import numpy as np
-import xarray as xr
 
 import matplotlib.pyplot as plt
 from matplotlib import cm
@@ -11,11 +8,19 @@ from matplotlib.colors import ListedColormap
 
 import cartopy.crs as ccrs
 
+from era5 import (ERA5_PRESSURE_LEVEL_PATH,
+                  climatology_filepath,
+                  open_climatology,
+                  add_region_arguments,
+                  OUTPUT_FORMATS)
 from plotting import plot_panarctic_panel, mask_greenland
 
 
-datafile = Path('/projects/AROSS/Reanalysis/ERA5/pressure_levels/monthly/',
-                'era5.pressure_levels.monthly.climatology.1980to2010.nc')
+path = ERA5_PRESSURE_LEVEL_PATH
+prefix = "era5.pressure_levels.monthly"
+
+year_start = 1980
+year_end = 2010
 
 cbar_kwargs = {'shrink': 0.95, 'orientation': 'horizontal', 'pad': 0.05}
 
@@ -25,21 +30,25 @@ thk_cmap = cm.get_cmap('cividis', 256)
 thk_cmap = ListedColormap(thk_cmap(np.linspace(0.1, 1.0, 256)))
 
 
-def plot_era5_thickness_climatology():
-    """Plots climatology figure"""
+def plot_era5_thickness_climatology(year_start=year_start, year_end=year_end,
+                                    bbox=None, min_latitude=None, fmt='netcdf'):
+    """Plots climatology figure from the climatology file written by
+    make_era5_*_climatology for the same years, region and format"""
 
-    ds = xr.open_dataset(datafile)
+    datafile = climatology_filepath(path, prefix, year_start, year_end,
+                                    bbox=bbox, min_latitude=min_latitude, fmt=fmt)
+    ds = open_climatology(datafile, month=7)
 
     fig = plt.figure(figsize=(7,7))
 
     ax1 = plot_panarctic_panel(fig, 111)
     cbar_kwargs['label'] = 'm'
-    ds.thickness.sel(month=7).plot.contourf(ax=ax1,
-                                            transform=ccrs.PlateCarree(),
-                                            vmin=5200, vmax=5600,
-                                            levels=np.arange(5400., 5600.+20., 20.),
-                                            cmap=thk_cmap,
-                                            cbar_kwargs=cbar_kwargs,)
+    ds.thickness.plot.contourf(ax=ax1,
+                               transform=ccrs.PlateCarree(),
+                               vmin=5200, vmax=5600,
+                               levels=np.arange(5400., 5600.+20., 20.),
+                               cmap=thk_cmap,
+                               cbar_kwargs=cbar_kwargs,)
     ax1.set_title('')
     ax1.text(0.02, 0.98, 'a) $\Delta z$',
              transform=ax1.transAxes,
@@ -53,4 +62,16 @@ def plot_era5_thickness_climatology():
 
 
 if __name__ == "__main__":
-    plot_era5_thickness_climatology()
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Plots July ERA5 climatology')
+    parser.add_argument('--year_start', type=int, default=year_start)
+    parser.add_argument('--year_end', type=int, default=year_end)
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, default='netcdf',
+                        dest='fmt', help='Format of climatology file (default netcdf)')
+    add_region_arguments(parser)
+
+    args = parser.parse_args()
+
+    plot_era5_thickness_climatology(year_start=args.year_start, year_end=args.year_end,
+                                    bbox=args.bbox, min_latitude=args.min_latitude, fmt=args.fmt)
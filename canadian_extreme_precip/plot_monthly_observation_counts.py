@@ -3,7 +3,8 @@ import matplotlib.pyplot as plt
 
 from plotting import plot_number_of_monthly_obs
 from reader import read_combined_file
-from filepath import FIGURE_PATH, combined_station_filelist
+from filepath import FIGURE_PATH
+from inventory import station_filelist
 
 
 def observations_per_month(x):
@@ -24,7 +25,7 @@ def to_observations(df):
 
 def main():
 
-    for station, filepath in combined_station_filelist().items():
+    for station, filepath in station_filelist().items():
         df = read_combined_file(filepath)
         df_count = to_observations(df)
         fig = plot_number_of_monthly_obs(df_count)
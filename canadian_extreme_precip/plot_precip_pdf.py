@@ -24,7 +24,8 @@ stations_list = [
 
 
 def load_precip_data(station):
-    df = read_combined_file(combined_station_filepath(station))
+    df = read_combined_file(combined_station_filepath(station),
+                            columns=['TOTAL_PRECIPITATION'])
     return df['TOTAL_PRECIPITATION']
 
 
@@ -1,13 +1,15 @@
 '''Makes a plot of station inventory showing number of observations per month
 for key variables'''
 
-from pathlib import Path
-
 import pandas as pd
 
-DATAPATH = Path('/home/apbarret/Data/Rain_on_snow/Canada_extreme_precip/Combined_files')
+from filepath import COMBINED_PATH
+from storage import list_files, open_file
+
+
 def check_missing_dates(f):
-    df = pd.read_csv(f, header=0, index_col=0, parse_dates=True)
+    with open_file(f) as fo:
+        df = pd.read_csv(fo, header=0, index_col=0, parse_dates=True)
     expected_index = pd.date_range(df.index[0], df.index[-1], freq='D')
     nrecords = len(df.index)
     nexpected = len(expected_index)
@@ -20,5 +22,5 @@ def check_missing_dates(f):
     print('-'*20)
 
 
-for f in DATAPATH.glob('*.csv'):
+for f in list_files(COMBINED_PATH, '*.csv'):
     check_missing_dates(f)
@@ -1,11 +1,8 @@
 """Plots location of stations"""
-from pathlib import Path
-
 import matplotlib.pyplot as plt
 
 from plotting import location_map
-
-FIGURE_PATH = Path.home() / 'src' / 'Canadian_extreme_precip' / 'figures'
+from filepath import FIGURE_PATH
 
 
 def plot_station_location_map(figsize=(10, 7)):
@@ -4,14 +4,15 @@
 import matplotlib.pyplot as plt
 
 from reader import read_combined_file
-from filepath import FIGURE_PATH, combined_station_filelist
+from filepath import FIGURE_PATH
+from inventory import station_filelist
 from plotting import plot_climatology, monthly_series
 from utils import to_monthly, to_climatology
 
 
 def plot_station_monthly_time_series(verbose=False):
     """Plot monthly time series of Arctic stations"""
-    for station, filepath in combined_station_filelist().items():
+    for station, filepath in station_filelist().items():
         if verbose: print(f"Generating monthly plot for {station.title()}")
         df = read_combined_file(filepath)
         df_mon = to_monthly(df)
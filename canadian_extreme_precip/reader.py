@@ -1,7 +1,21 @@
 '''Readers for files'''
 
+import os
+from pathlib import Path
+
 import pandas as pd
 
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Without pyarrow every read parses the csv file
+    pq = None
+
+from canadian_extreme_precip.config import get_setting, get_path
+from canadian_extreme_precip.flags import ECCC_FLAGS
+from canadian_extreme_precip.storage import (open_file, file_stat,
+                                             split_archive_path)
+
 
 column_dtype = {
     'MEAN_TEMPERATURE_FLAG': str,
@@ -19,22 +33,324 @@ column_dtype = {
     'MAX_REL_HUMIDITY_FLAG': str,
     }
 
+# Flags are stored as codes of one categorical type so records from
+# different stations can be combined without converting flags to strings.
+# Empty flags are read as missing.
+FLAG_DTYPE = pd.CategoricalDtype([flag for flag in ECCC_FLAGS if flag])
+# Values are reported to 0.1 so float32 values can be restored exactly
+# by rounding
+VALUE_DECIMALS = 1
 
-def read_station_file(station_file):
-    '''Reads raw station file
-    A description of Flags is here
-    https://climate.weather.gc.ca/doc/Technical_Documentation.pdf'''
-    df = pd.read_csv(station_file, index_col='LOCAL_DATE',
-                     dtype=column_dtype, parse_dates=True)
+# Columnar copies of csv files are kept in this directory next to the source,
+# or next to the archive holding the source
+CACHE_DIRNAME = '.cache'
+# Alternatively, columnar copies can be kept under a single directory, e.g.
+# on a fast local disk, set with cache_root in config.py
+CACHE_ROOT = get_path('cache_root', section='storage')
+# Format of columnar copies.  parquet files are compressed and date ranges
+# skip row groups.  feather files are uncompressed Arrow files that are
+# memory mapped, so reading columns needs no decompression or copying.
+CACHE_FORMATS = ['parquet', 'feather']
+# Changes when the layout of cached dataframes changes
+CACHE_VERSION = '2'
+CACHE_FORMAT = get_setting('cache_format', 'parquet', section='storage')
+if CACHE_FORMAT not in CACHE_FORMATS:
+    raise ValueError(f'Unknown cache_format {CACHE_FORMAT}, expected one of {CACHE_FORMATS}')
+# Rows per parquet row group, about 10 years of daily records, so that date
+# ranges can skip row groups
+CACHE_ROW_GROUP_SIZE = 3653
+# Rows per chunk when reading date ranges from csv files
+CSV_CHUNKSIZE = 10000
+
+
+def cache_filepath(fpath, cache_format=None):
+    '''Returns path to the columnar cache for a csv file'''
+    fpath = Path(fpath).absolute()
+    suffix = cache_format or CACHE_FORMAT
+    if CACHE_ROOT is not None:
+        # Mirror source path under CACHE_ROOT so names do not collide
+        return CACHE_ROOT / fpath.relative_to(fpath.anchor).parent / f'{fpath.name}.{suffix}'
+    archive, member = split_archive_path(fpath)
+    if member is not None:
+        return archive.parent / CACHE_DIRNAME / archive.name / f'{member}.{suffix}'
+    return fpath.parent / CACHE_DIRNAME / f'{fpath.name}.{suffix}'
+
+
+def _source_signature(fpath):
+    '''Returns size and modification time of source file as cache metadata'''
+    stat = file_stat(fpath)
+    return {
+        b'source_size': str(stat.st_size).encode(),
+        b'source_mtime_ns': str(stat.st_mtime_ns).encode(),
+        b'cache_version': CACHE_VERSION.encode(),
+        }
+
+
+def _flag_dtype(flags):
+    '''Returns FLAG_DTYPE, with any flags not in ECCC_FLAGS added so that
+    no flags are lost'''
+    if isinstance(flags.dtype, pd.CategoricalDtype):
+        values = flags.cat.categories
+    else:
+        values = flags.dropna().unique()
+    unknown = sorted(set(values) - set(FLAG_DTYPE.categories))
+    if unknown:
+        return pd.CategoricalDtype(list(FLAG_DTYPE.categories) + unknown)
+    return FLAG_DTYPE
+
+
+def to_compact(df):
+    '''Converts a station dataframe to a compact layout in place.  Flags are
+    stored as FLAG_DTYPE categoricals, one byte per record, and variable
+    values as float32.  Other text columns that repeat, e.g. STATION_NAME,
+    are stored as categoricals.  Reduces memory use several times.
+
+    :returns: dataframe
+    '''
+    for flag in column_dtype:
+        if flag in df:
+            df[flag] = df[flag].astype(_flag_dtype(df[flag]))
+        variable = flag[:-len('_FLAG')]
+        if variable in df:
+            df[variable] = df[variable].astype('float32')
+    for column in df.columns[df.dtypes == object]:
+        if df[column].nunique() < len(df) // 2:
+            df[column] = df[column].astype('category')
     return df
 
 
-def read_combined_file(fpath):
-    '''Reads combined file'''
-    df = pd.read_csv(fpath, index_col=0, dtype=column_dtype, parse_dates=True)
+def from_compact(df):
+    '''Converts a dataframe from to_compact to the layout of pandas.read_csv,
+    with flags and text as objects and values as float64.  Values are
+    rounded to VALUE_DECIMALS so they equal values parsed from csv files.
+
+    :returns: new dataframe
+    '''
+    df = df.copy()
+    for column in df.columns[df.dtypes == 'category']:
+        df[column] = df[column].astype(object)
+    for flag in column_dtype:
+        variable = flag[:-len('_FLAG')]
+        if variable in df and df[variable].dtype == 'float32':
+            df[variable] = df[variable].astype('float64').round(VALUE_DECIMALS)
+    return df
+
+
+def date_bounds(start, end):
+    '''Returns first and last timestamps for a date range.  As for pandas
+    slicing, a partial date string for end includes the whole period, e.g.
+    end='1995' includes 1995-12-31'''
+    first = None if start is None else pd.Timestamp(start)
+    if end is None:
+        last = None
+    elif isinstance(end, str):
+        last = pd.Period(end).end_time
+    else:
+        last = pd.Timestamp(end)
+    return first, last
+
+
+def _select(df, columns=None, first=None, last=None):
+    '''Returns columns and rows between first and last from a dataframe'''
+    if first is not None:
+        df = df[df.index >= first]
+    if last is not None:
+        df = df[df.index <= last]
+    if columns is not None:
+        df = df[columns]
     return df
 
 
+def _read_feather(cache, columns=None, first=None, last=None):
+    '''Reads columns from memory mapped feather cache.  Only the selected
+    columns are converted to pandas'''
+    table = pa.ipc.open_file(pa.memory_map(str(cache), 'r')).read_all()
+    if columns is not None:
+        index_name = table.schema.pandas_metadata['index_columns'][0]
+        table = table.select(list(columns) + [index_name])
+    return _select(table.to_pandas(), columns=columns, first=first, last=last)
+
+
+def _read_schema(cache):
+    '''Returns arrow schema of a cache file'''
+    if cache.suffix == '.feather':
+        return pa.ipc.open_file(pa.memory_map(str(cache), 'r')).schema
+    return pq.read_schema(cache)
+
+
+def _read_cache(fpath, columns=None, first=None, last=None):
+    '''Returns cached dataframe for fpath or None if cache is missing or
+    out of date.  Only requested columns are read and, for parquet, row
+    groups outside first and last are skipped.'''
+    cache = cache_filepath(fpath)
+    if pq is None or not cache.exists():
+        return None
+    schema = _read_schema(cache)
+    metadata = schema.metadata or {}
+    for key, value in _source_signature(fpath).items():
+        if metadata.get(key) != value:
+            return None
+    if cache.suffix == '.feather':
+        return _read_feather(cache, columns=columns, first=first, last=last)
+    index_name = schema.pandas_metadata['index_columns'][0]
+    filters = []
+    if first is not None:
+        filters.append((index_name, '>=', first))
+    if last is not None:
+        filters.append((index_name, '<=', last))
+    table = pq.read_table(cache, columns=columns, filters=filters or None,
+                          use_pandas_metadata=True)
+    return _select(table.to_pandas(), columns=columns)
+
+
+def _write_cache(df, fpath, signature):
+    '''Writes dataframe to columnar cache.  signature is taken before the
+    source is parsed so a file modified during the read is not cached as
+    current.  Failure to write the cache is not an error.'''
+    if pq is None:
+        return
+    cache = cache_filepath(fpath)
+    table = pa.Table.from_pandas(df)
+    table = table.replace_schema_metadata({**table.schema.metadata,
+                                           **signature})
+    tmpfile = cache.with_name(f'{cache.name}.{os.getpid()}.tmp')
+    try:
+        cache.parent.mkdir(parents=True, exist_ok=True)
+        if cache.suffix == '.feather':
+            with pa.ipc.new_file(tmpfile, table.schema) as writer:
+                writer.write_table(table, max_chunksize=CACHE_ROW_GROUP_SIZE)
+        else:
+            pq.write_table(table, tmpfile, row_group_size=CACHE_ROW_GROUP_SIZE)
+        os.replace(tmpfile, cache)  # atomic so concurrent readers never see partial files
+    except OSError:
+        if tmpfile.exists():
+            tmpfile.unlink()
+    return
+
+
+def _iter_csv_chunks(fpath, index_col, columns=None, first=None, last=None,
+                     chunksize=CSV_CHUNKSIZE):
+    '''Yields chunks of a csv file between first and last.  Only the index
+    and requested columns are parsed.  Files are assumed to be in date
+    order so reading stops after last.'''
+    with open_file(fpath) as f:
+        header = pd.read_csv(f, nrows=0).columns.tolist()
+    index_pos = header.index(index_col) if isinstance(index_col, str) else index_col
+    if columns is None:
+        usecols = None
+    else:
+        usecols = sorted({index_pos} | {header.index(c) for c in columns})
+        index_pos = usecols.index(index_pos)
+
+    with open_file(fpath) as f, pd.read_csv(f, index_col=index_pos, usecols=usecols,
+                                            dtype=column_dtype, parse_dates=True,
+                                            chunksize=chunksize) as reader:
+        for chunk in reader:
+            yield _select(chunk, columns=columns, first=first, last=last)
+            if last is not None and chunk.index[-1] > last:
+                break
+
+
+def _read_csv_subset(fpath, index_col, columns=None, first=None, last=None,
+                     chunksize=CSV_CHUNKSIZE):
+    '''Reads columns and date range from a csv file in chunks so rows
+    outside the date range are never held in memory'''
+    return pd.concat(_iter_csv_chunks(fpath, index_col, columns=columns,
+                                      first=first, last=last,
+                                      chunksize=chunksize))
+
+
+def _read_csv(fpath, index_col):
+    '''Reads whole csv file, which may be in an archive'''
+    with open_file(fpath) as f:
+        return pd.read_csv(f, index_col=index_col, dtype=column_dtype,
+                           parse_dates=True)
+
+
+def _read_csv_cached(fpath, index_col, use_cache=True,
+                     columns=None, start=None, end=None, compact=False):
+    '''Reads csv file via columnar cache, refreshing the cache if the
+    source file has changed since it was written.  The cache is in the
+    compact layout of to_compact.
+
+    :fpath: path to csv file
+    :index_col: name or position of date column
+    :use_cache: read from and write to cache (default True)
+    :columns: list of columns to return (default all)
+    :start: first date to return (default start of record)
+    :end: last date to return (default end of record)
+    :compact: return the compact layout, otherwise the dtypes of
+              pandas.read_csv (default False)
+
+    :returns: pandas dataframe
+    '''
+    first, last = date_bounds(start, end)
+    if use_cache and pq is not None:
+        df = _read_cache(fpath, columns=columns, first=first, last=last)
+        if df is None:
+            # Cache holds the full file so parse all of it once
+            signature = _source_signature(fpath)
+            full = to_compact(_read_csv(fpath, index_col))
+            _write_cache(full, fpath, signature)
+            df = _select(full, columns=columns, first=first, last=last)
+        return df if compact else from_compact(df)
+    if columns is None and start is None and end is None:
+        df = _read_csv(fpath, index_col)
+    else:
+        df = _read_csv_subset(fpath, index_col, columns=columns,
+                              first=first, last=last)
+    return to_compact(df) if compact else df
+
+
+def read_station_file(station_file, columns=None, start=None, end=None,
+                      use_cache=True, compact=False):
+    '''Reads raw station file
+    A description of Flags is here
+    https://climate.weather.gc.ca/doc/Technical_Documentation.pdf
+
+    A columnar copy is kept in a .cache directory next to the file, or
+    under CACHE_ROOT, and used in place of the csv until the csv size or
+    modification time changes.  station_file may be in an archive, see
+    storage.py.
+
+    :station_file: path to station file
+    :columns: list of columns to read (default all)
+    :start: first date to read, e.g. '1960' or '1960-01-01' (default all)
+    :end: last date to read, partial dates include the whole period so
+          end='1995' reads to 1995-12-31 (default all)
+    :use_cache: use columnar cache (default True)
+    :compact: return flags as categoricals and variables as float32, see
+              to_compact.  Otherwise dtypes are those of pandas.read_csv
+              (default False)
+    '''
+    return _read_csv_cached(station_file, 'LOCAL_DATE', use_cache=use_cache,
+                            columns=columns, start=start, end=end,
+                            compact=compact)
+
+
+def iter_station_file(station_file, columns=None, start=None, end=None,
+                      chunksize=CSV_CHUNKSIZE, compact=False):
+    '''Reads raw station file in chunks of chunksize rows, for processing
+    records without holding the whole file in memory.  Rows outside start
+    and end are dropped as they are read.  See read_station_file for
+    arguments.
+
+    :returns: generator of pandas dataframes in file order
+    '''
+    first, last = date_bounds(start, end)
+    for chunk in _iter_csv_chunks(station_file, 'LOCAL_DATE', columns=columns,
+                                  first=first, last=last, chunksize=chunksize):
+        yield to_compact(chunk.copy()) if compact else chunk
+
+
+def read_combined_file(fpath, columns=None, start=None, end=None,
+                       use_cache=True, compact=False):
+    '''Reads combined file.  See read_station_file for arguments'''
+    return _read_csv_cached(fpath, 0, use_cache=use_cache,
+                            columns=columns, start=start, end=end,
+                            compact=compact)
+
+
 def read_cyclone_climatology(fpath):
     """Reads cyclone climatology and parses into multi-index dataframe"""
     df = pd.read_csv(fpath, index_col=0)
@@ -44,3 +360,8 @@ def read_cyclone_climatology(fpath):
 def read_climatology(fpath):
     """Reads climatology file"""
     return pd.read_csv(fpath, index_col=0)
+
+
+def read_station_locations(fpath):
+    """Reads station locations file, indexed by station name"""
+    return pd.read_csv(fpath, index_col=0, header=0, skipinitialspace=True)
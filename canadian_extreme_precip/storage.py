@@ -0,0 +1,97 @@
+'''Access to source files in directories or compressed archives.
+
+A path that passes through a zip or tar archive, e.g.
+Raw_station_files.zip/2400300_climate_daily.csv, refers to a member of
+the archive, so data paths in config.py can point to an archive in place
+of a directory.  Zip archives are preferred because members can be read
+without decompressing the whole archive.  Archives are read only.
+'''
+
+from contextlib import contextmanager
+from pathlib import Path
+import fnmatch
+import os
+import tarfile
+import zipfile
+
+
+ARCHIVE_SUFFIXES = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz')
+
+
+def split_archive_path(fpath):
+    '''Splits a path into archive and member
+
+    :returns: path to archive and member name, or fpath and None if fpath
+              is not in an archive
+    '''
+    fpath = Path(fpath)
+    for parent in [fpath, *fpath.parents]:
+        if parent.name.endswith(ARCHIVE_SUFFIXES) and parent.is_file():
+            member = fpath.relative_to(parent).as_posix()
+            return parent, None if member == '.' else member
+    return fpath, None
+
+
+def _member_names(archive):
+    '''Returns names of files in an archive'''
+    if zipfile.is_zipfile(archive):
+        with zipfile.ZipFile(archive) as zf:
+            return [info.filename for info in zf.infolist() if not info.is_dir()]
+    with tarfile.open(archive) as tf:
+        return [info.name for info in tf.getmembers() if info.isfile()]
+
+
+@contextmanager
+def open_file(fpath):
+    '''Opens a file, or archive member, for reading in binary mode'''
+    archive, member = split_archive_path(fpath)
+    if member is None:
+        with open(fpath, 'rb') as f:
+            yield f
+    elif zipfile.is_zipfile(archive):
+        with zipfile.ZipFile(archive) as zf, zf.open(member) as f:
+            yield f
+    else:
+        with tarfile.open(archive) as tf:
+            f = tf.extractfile(member)
+            if f is None:
+                raise FileNotFoundError(f'{member} not found in {archive}')
+            with f:
+                yield f
+
+
+def file_exists(fpath):
+    '''True if file, or archive member, exists'''
+    archive, member = split_archive_path(fpath)
+    if member is None:
+        return Path(fpath).is_file()
+    return member in _member_names(archive)
+
+
+def file_stat(fpath):
+    '''Returns os.stat_result for a file.  For archive members this is the
+    stat of the archive, so any change to the archive changes the stat of
+    its members.'''
+    return os.stat(split_archive_path(fpath)[0])
+
+
+def read_bytes(fpath):
+    '''Returns contents of file, or archive member'''
+    with open_file(fpath) as f:
+        return f.read()
+
+
+def list_files(directory, pattern='*'):
+    '''Lists files in a directory, or a directory in an archive, matching a
+    glob pattern
+
+    :returns: sorted list of paths
+    '''
+    archive, member = split_archive_path(directory)
+    if archive == Path(directory) and member is None and not archive.is_file():
+        return sorted(Path(directory).glob(pattern))
+    prefix = '' if member is None else member.rstrip('/') + '/'
+    names = [name[len(prefix):] for name in _member_names(archive)
+             if name.startswith(prefix)]
+    return sorted(Path(directory) / name for name in names
+                  if '/' not in name and fnmatch.fnmatch(name, pattern))
@@ -1,5 +1,34 @@
 """Contains functions for processing data files"""
 import numpy as np
+import pandas as pd
+
+from canadian_extreme_precip.reader import from_compact
+
+
+# Variables aggregated to monthly means, sums and fraction of days with
+# values greater than zero
+MONTHLY_MEAN_VARIABLES = ['MEAN_TEMPERATURE', 'MIN_TEMPERATURE', 'MAX_TEMPERATURE']
+MONTHLY_SUM_VARIABLES = ['TOTAL_PRECIPITATION', 'TOTAL_RAIN', 'TOTAL_SNOW']
+MONTHLY_FRACTION_VARIABLES = ['SNOW_ON_GROUND']
+
+# Rules for accepting a month in monthly aggregation.  Keywords are those
+# of month_completeness.  WMO rule from WMO-TD No. 1377: a month is
+# rejected if more than 5 days in total or more than 3 consecutive days
+# are missing.
+COMPLETENESS_RULES = {
+    'complete': {'max_missing': 0},
+    'wmo': {'max_missing': 5, 'max_consecutive_missing': 3},
+    }
+
+# Variables that a completeness rule is given for in to_monthly.  The WMO
+# rule is for means; sums of months with missing days are biased low, so
+# sums keep the complete rule unless a rule is given for them
+MONTHLY_VARIABLE_GROUPS = {
+    'mean': MONTHLY_MEAN_VARIABLES,
+    'sum': MONTHLY_SUM_VARIABLES,
+    'fraction': MONTHLY_FRACTION_VARIABLES,
+    }
+DEFAULT_GROUP_RULES = {'mean': None, 'sum': 'complete', 'fraction': None}
 
 
 def snow_day_fraction(x):
@@ -33,10 +62,100 @@ def month_sum(x):
     return xsum
 
 
-def to_monthly(df):
-    """Calculate monthly time series
+def _monthly(df):
+    """Returns resampler for monthly reductions.  df is indexed by date or,
+    for a panel from panel.load_panel, by station and date"""
+    if isinstance(df.index, pd.MultiIndex):
+        return df.groupby([pd.Grouper(level=0),
+                           pd.Grouper(level=-1, freq='M')], sort=False)
+    return df.resample('M')
 
-    :df: pandas dataframe containing:
+
+def longest_missing_run(df):
+    """Returns the longest run of consecutive days without observations
+    in each month.  Days missing from the index count as missing.
+
+    :df: pandas dataframe with a daily DatetimeIndex or a panel indexed
+         by station and date
+
+    :returns: pandas dataframe with a monthly index
+    """
+    if isinstance(df.index, pd.MultiIndex):
+        return pd.concat({station: longest_missing_run(group.droplevel(0))
+                          for station, group in df.groupby(level=0, sort=False)},
+                         names=df.index.names)
+    first = df.index.min().to_period('M').start_time
+    last = df.index.max().to_period('M').end_time.normalize()
+    days = pd.date_range(first, last, freq='D')
+    missing = df.reindex(days).isna().values.astype(int)
+
+    # Running count of missing days restarts on days with observations and
+    # on the first day of each month
+    nmissing = missing.cumsum(axis=0)
+    restart = (missing == 0) | (days.day == 1)[:, np.newaxis]
+    base = pd.DataFrame(np.where(restart, nmissing - missing, np.nan)).ffill().values
+    run_length = pd.DataFrame(nmissing - base, index=days, columns=df.columns)
+    return run_length.resample('M').max()
+
+
+def month_completeness(count, daysinmonth, df=None, max_missing=None,
+                       max_consecutive_missing=None, min_fraction=None):
+    """Applies completeness rule to monthly counts of observations.  None
+    means no limit is applied.
+
+    :count: pandas dataframe of number of observations in each month
+    :daysinmonth: array of days in each month
+    :df: daily dataframe, only needed for max_consecutive_missing
+    :max_missing: maximum number of days without observations
+    :max_consecutive_missing: maximum number of consecutive days without
+                              observations
+    :min_fraction: minimum fraction of days with observations
+
+    :returns: boolean array, True where month is accepted
+    """
+    daysinmonth = daysinmonth[:, np.newaxis]
+    accept = np.ones(count.shape, dtype=bool)
+    if max_missing is not None:
+        accept &= (daysinmonth - count.values) <= max_missing
+    if min_fraction is not None:
+        accept &= (count.values / daysinmonth) >= min_fraction
+    if max_consecutive_missing is not None:
+        run_length = longest_missing_run(df).reindex(count.index)
+        accept &= run_length.values <= max_consecutive_missing
+    return accept
+
+
+def _group_rules(rule):
+    """Returns completeness keywords for each group in
+    MONTHLY_VARIABLE_GROUPS.  A single rule applies to means and
+    fractions, sums use the complete rule"""
+    if isinstance(rule, dict) and rule and set(rule) <= set(MONTHLY_VARIABLE_GROUPS):
+        rules = {group: 'complete' for group in MONTHLY_VARIABLE_GROUPS}
+        rules.update(rule)
+    else:
+        rules = {group: rule if default is None else default
+                 for group, default in DEFAULT_GROUP_RULES.items()}
+    return {group: COMPLETENESS_RULES[r] if isinstance(r, str) else r
+            for group, r in rules.items()}
+
+
+def to_monthly(df, rule='complete', return_completeness=False):
+    """Calculate monthly time series.  With the default rule this gives the
+    same result as applying month_mean, month_sum and snow_day_fraction to
+    each month but uses built-in resample reductions.  Months that fail
+    the completeness rule are set to NaN.  Means and the snow on ground
+    fraction for accepted months with missing days are of the days with
+    observations.  Float32 values from reader.to_compact are rounded back
+    to the values in the csv files before the reductions.
+
+    A single rule, e.g. 'wmo', only applies to means and fractions.  Sums
+    of months with missing days are biased low, so precipitation, rain
+    and snow totals are only kept for complete months.  To relax the rule
+    for sums give a rule for each group, e.g.
+    {'mean': 'wmo', 'sum': {'max_missing': 1}}.
+
+    :df: pandas dataframe, indexed by date or by station and date,
+         containing:
             MEAN_TEMPERATURE
             MIN_TEMPERATURE
             MAX_TEMPERATURE
@@ -44,16 +163,41 @@ def to_monthly(df):
             TOTAL_RAIN
             TOTAL_SNOW
             SNOW_ON_GROUND
+    :rule: name of rule in COMPLETENESS_RULES, dict of keywords for
+           month_completeness, or dict of rules keyed by group in
+           MONTHLY_VARIABLE_GROUPS, groups that are not given use the
+           complete rule (default 'complete', all days observed)
+    :return_completeness: also return fraction of days with observations
+                          in each month (default False)
+
+    :returns: pandas dataframe of monthly values and, if
+              return_completeness is True, dataframe of completeness
     """
-    return df.resample('M').apply({
-        'MEAN_TEMPERATURE': month_mean,
-        'MIN_TEMPERATURE': month_mean,
-        'MAX_TEMPERATURE': month_mean,
-        'TOTAL_PRECIPITATION': month_sum,
-        'TOTAL_RAIN': month_sum,
-        'TOTAL_SNOW': month_sum,
-        'SNOW_ON_GROUND': snow_day_fraction,  # Days with snow on the ground
-        })
+    variables = (MONTHLY_MEAN_VARIABLES + MONTHLY_SUM_VARIABLES +
+                 MONTHLY_FRACTION_VARIABLES)
+    values = from_compact(df[variables]).astype('float64')
+    resampler = _monthly(values)
+    count = resampler.count()
+    total = resampler.sum()
+    # Days with snow on the ground
+    positive = _monthly(values[MONTHLY_FRACTION_VARIABLES] > 0).sum()
+
+    daysinmonth = count.index.get_level_values(-1).daysinmonth.values
+    monthly = pd.concat([
+        total[MONTHLY_MEAN_VARIABLES] / count[MONTHLY_MEAN_VARIABLES],
+        total[MONTHLY_SUM_VARIABLES],
+        positive / count[MONTHLY_FRACTION_VARIABLES],
+        ], axis=1)
+    accept = pd.concat([
+        pd.DataFrame(month_completeness(count[group_variables], daysinmonth,
+                                        df=values[group_variables],
+                                        **_group_rules(rule)[group]),
+                     index=count.index, columns=group_variables)
+        for group, group_variables in MONTHLY_VARIABLE_GROUPS.items()], axis=1)
+    monthly = monthly.where(accept[monthly.columns])
+    if return_completeness:
+        return monthly, count.divide(daysinmonth, axis='rows')
+    return monthly
 
 
 def to_climatology(df):
@@ -68,5 +212,10 @@ def to_climatology(df):
             TOTAL_RAIN
             TOTAL_SNOW
             SNOW_ON_GROUND
+         indexed by date or by station and date
     """
+    if isinstance(df.index, pd.MultiIndex):
+        month = df.index.get_level_values(-1).month.rename('month')
+        return df.groupby([df.index.get_level_values(0), month],
+                          sort=False).mean()
     return df.groupby(df.index.month).mean()
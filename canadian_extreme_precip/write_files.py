@@ -1,5 +1,8 @@
 '''Module for writing station data to stdout of file'''
 
+import numpy as np
+import pandas as pd
+
 these_columns = [
     'MEAN_TEMPERATURE',
     'MEAN_TEMPERATURE_FLAG',
@@ -22,31 +25,54 @@ HEADER = [
     'TMEAN', 'TMIN', 'TMAX', 'TOTALP', 'RAIN', 'SNOW', 'DSNOW'
     ]
 
-def record_fmt(rec):
-    '''Generates a formated string for a data record
+# Rows formatted and written at a time
+CHUNKSIZE = 10000
 
-    Assumes only temperature and precip data
 
-    :r: record/row from iterrows
+def var_fmt(df, var):
+    '''Formats a variable and its flag for all rows of a dataframe.  Data
+    have few distinct values so each distinct value is formatted once and
+    the strings are looked up for each row.
+
+    :df: pandas dataframe
+    :var: variable name
+
+    :returns: lists of strings, values as 6.1f and flags padded to 3
+              characters.  Missing flags are written as nan'''
+    # Unique on bit patterns so that -0.0 and 0.0 are formatted separately
+    values = df[var].values.astype('float64')
+    unique_bits, value_index = np.unique(values.view('int64'),
+                                         return_inverse=True)
+    unique_values = unique_bits.view('float64')
+    values = np.array(['%6.1f' % v for v in unique_values])[value_index]
 
-    :returns: str'''
-    index = rec[0]
-    data = rec[1]
-    sfmt = [index.strftime('%Y-%m-%d')]
-    varnames = [v for v in data.index if '_FLAG' not in v]
-    for v in varnames:
-        sfmt.append(var_fmt(data, v))
-    return ' '.join(sfmt) + '\n'
+    flag_index, unique_flags = pd.factorize(df[var + '_FLAG'])
+    # Missing flags have index -1, the last element
+    flags = np.array([f'{f:3}' for f in unique_flags] + ['nan'])[flag_index]
+    return [values.tolist(), flags.tolist()]
+
+
+def records_fmt(df, columns=these_columns):
+    '''Generates formatted strings for all records in a dataframe
+
+    Assumes only temperature and precip data
 
+    :df: pandas dataframe
+    :columns: variables and flags to format
 
-def var_fmt(r, var):
-    var_flag = var + '_FLAG'
-    return f'{r[var]:6.1f} {r[var_flag]:3}' 
+    :returns: str with one line per record'''
+    fields = [df.index.values.astype('datetime64[D]').astype(str).tolist()]
+    for v in [c for c in columns if '_FLAG' not in c]:
+        fields.extend(var_fmt(df, v))
+    return ''.join(' '.join(record) + '\n' for record in zip(*fields))
 
 
-def write_formatted_data(df, outfile, columns=these_columns):
+def write_formatted_data(df, outfile, columns=these_columns,
+                         chunksize=CHUNKSIZE):
+    '''Writes fixed width text file of variables and flags.  Rows are
+    formatted in chunks of chunksize and written as each chunk is ready'''
     with open(outfile, 'w') as f:
-        f.write(', '.join(these_columns)+'\n')
-        for record in df[these_columns].iterrows():
-            f.write(record_fmt(record))
+        f.write(', '.join(columns)+'\n')
+        for start in range(0, len(df), chunksize):
+            f.write(records_fmt(df.iloc[start:start+chunksize], columns))
     return